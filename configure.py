@@ -475,6 +475,18 @@ parser.add_option('--debug-lib',
     dest='node_debug_lib',
     help='build lib with DCHECK macros')
 
+parser.add_option('--js2c-raw-strings',
+    action='store_true',
+    dest='js2c_raw_strings',
+    help='embed lib as C++ raw string literals instead of arrays, which is '
+         'faster to compile (not supported by MSVC)')
+
+parser.add_option('--js2c-compress',
+    action='store_true',
+    dest='js2c_compress',
+    help='embed lib compressed with zlib and inflate each module the first '
+         'time it is loaded, which makes the binary smaller')
+
 http2_optgroup.add_option('--debug-nghttp2',
     action='store_true',
     dest='debug_nghttp2',
@@ -1105,6 +1117,11 @@ def configure_node(o):
 
   o['variables']['node_debug_lib'] = b(options.node_debug_lib)
 
+  if options.js2c_raw_strings and flavor == 'win':
+    error('--js2c-raw-strings is not supported on Windows')
+  o['variables']['node_js2c_raw_strings'] = b(options.js2c_raw_strings)
+  o['variables']['node_js2c_compress'] = b(options.js2c_compress)
+
   if options.debug_nghttp2:
     o['variables']['debug_nghttp2'] = 1
   else:
@@ -34,9 +34,10 @@
 # for py2/py3 compatibility
 from functools import reduce
 
+import hashlib
+import multiprocessing
 import os, re
 import optparse
-import textwrap
 
 
 class Error(Exception):
@@ -44,12 +45,57 @@ class Error(Exception):
     Exception.__init__(self, msg)
 
 
-def ToCArray(byte_sequence):
-  result = []
-  for chr in byte_sequence:
-    result.append(str(ord(chr)))
-  joined = ", ".join(result)
-  return textwrap.fill(joined, 80)
+class CArrayWriter(object):
+  """Writes bytes to a file as a comma separated list of numbers.
+
+  The numbers are filled into lines of at most 80 characters, as
+  textwrap.fill would do for the whole list, but the bytes can be passed
+  in one piece at a time.
+  """
+
+  NUMBERS = [str(i) for i in range(256)]
+
+  def __init__(self, output, width=80):
+    self.output = output
+    self.width = width
+    self.line_length = 0
+    # The last number is only written once it is known whether another one
+    # follows it, which decides if it gets a comma.
+    self.pending = None
+
+  def Write(self, byte_sequence):
+    numbers = self.NUMBERS
+    width = self.width
+    line_length = self.line_length
+    pending = self.pending
+    chunks = []
+    for byte in bytearray(byte_sequence):
+      if pending is not None:
+        word = pending + ","
+        if line_length == 0:
+          line_length = len(word)
+          chunks.append(word)
+        elif line_length + 1 + len(word) <= width:
+          line_length += 1 + len(word)
+          chunks.append(" " + word)
+        else:
+          line_length = len(word)
+          chunks.append("\n" + word)
+      pending = numbers[byte]
+    self.output.write("".join(chunks))
+    self.line_length = line_length
+    self.pending = pending
+
+  def Close(self):
+    if self.pending is None:
+      return
+    if self.line_length == 0:
+      self.output.write(self.pending)
+    elif self.line_length + 1 + len(self.pending) <= self.width:
+      self.output.write(" " + self.pending)
+    else:
+      self.output.write("\n" + self.pending)
+    self.pending = None
 
 
 def RemoveCommentsEmptyLinesAndWhitespace(lines):
@@ -184,100 +230,109 @@ def BuildFilterChain():
 def BuildExtraFilterChain():
   return lambda x: RemoveCommentsEmptyLinesAndWhitespace(Validate(x))
 
-class Sources:
-  def __init__(self):
-    self.names = []
-    self.modules = []
-
-def PrepareSources(source_files, native_type, emit_js):
-  """Read, prepare and assemble the list of source files.
-
-  Args:
-    source_files: List of JavaScript-ish source files.
-    native_type: String corresponding to a NativeType enum value, allowing us
-        to treat different types of sources differently.
-    emit_js: True if we should skip the byte conversion and just leave the
-        sources as JS strings.
+class FilterCache(object):
+  """Stores filtered sources in a directory.
 
-  Returns:
-    An instance of Sources.
+  Each filtered source is stored in a file named after a hash of the
+  unfiltered contents and of this script, so a file is only filtered again
+  when one of them has changed.
   """
-  filters = BuildFilterChain()
-
-  source_files_and_contents = [(f, ReadFile(f)) for f in source_files]
-
-  # Have a single not-quite-empty source file if there are none present;
-  # otherwise you get errors trying to compile an empty C++ array.
-  # It cannot be empty (or whitespace, which gets trimmed to empty), as
-  # the deserialization code assumes each file is nonempty.
-  if not source_files_and_contents:
-    source_files_and_contents = [("dummy.js", "(function() {})")]
 
-  result = Sources()
+  def __init__(self, directory):
+    self.directory = directory
+    self.used = set()
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    with open(os.path.splitext(__file__)[0] + ".py", "rb") as script:
+      self.digest = hashlib.sha1(script.read())
+
+  def Key(self, contents):
+    digest = self.digest.copy()
+    digest.update(contents.encode("utf-8"))
+    return digest.hexdigest()
+
+  def Path(self, key):
+    return os.path.join(self.directory, key + ".js")
+
+  def Get(self, key):
+    """Returns the filtered source stored for a key, or None."""
+    self.used.add(key)
+    try:
+      return ReadFile(self.Path(key))
+    except (IOError, OSError):
+      return None
 
-  for (source, contents) in source_files_and_contents:
+  def Put(self, key, lines):
+    path = self.Path(key)
+    output = open(path + ".tmp", "w")
     try:
-      lines = filters(contents)
-    except Error as e:
-      raise Error("In file %s:\n%s" % (source, str(e)))
+      output.write(lines)
+    finally:
+      output.close()
+    if os.path.exists(path):
+      os.remove(path)
+    os.rename(path + ".tmp", path)
+
+  def Prune(self):
+    """Removes the entries that were not used by this run."""
+    for name in os.listdir(self.directory):
+      if os.path.splitext(name)[0] not in self.used:
+        os.remove(os.path.join(self.directory, name))
 
-    result.modules.append(lines)
 
-    name = os.path.basename(source)[:-3]
-    result.names.append(name)
+NON_ASCII_PATTERN = re.compile(r'[^\x00-\x7f]')
 
-  return result
+def FilterSource(source_and_contents):
+  """Runs the contents of a source file through the filter chain."""
+  (source, contents) = source_and_contents
+  try:
+    lines = BuildFilterChain()(contents)
+  except Error as e:
+    raise Error("In file %s:\n%s" % (source, str(e)))
+  # The sources are expected to be ASCII-only.
+  assert not NON_ASCII_PATTERN.search(lines)
+  return lines
 
 
-def BuildMetadata(sources, source_bytes, native_type):
-  """Build the meta data required to generate a libaries file.
+def FilterSources(source_files_and_contents, jobs, cache):
+  """Filters source files, yielding each result as soon as it is ready.
 
   Args:
-    sources: A Sources instance with the prepared sources.
-    source_bytes: A list of source bytes.
-        (The concatenation of all sources; might be compressed.)
-    native_type: The parameter for the NativesCollection template.
+    source_files_and_contents: List of (file name, contents) pairs.
+    jobs: Number of processes to filter the sources in.
+    cache: A FilterCache, or None.
 
-  Returns:
-    A dictionary for use with HEADER_TEMPLATE.
+  Yields:
+    The filtered source of each file, in order.
   """
-  total_length = len(source_bytes)
-  raw_sources = "".join(sources.modules)
-
-  # The sources are expected to be ASCII-only.
-  assert not filter(lambda value: ord(value) >= 128, raw_sources)
-
-  # Loop over modules and build up indices into the source blob:
-  get_index_cases = []
-  get_script_name_cases = []
-  get_script_source_cases = []
-  offset = 0
-  for i in range(len(sources.modules)):
-    native_name = "native %s.js" % sources.names[i]
-    d = {
-        "i": i,
-        "id": sources.names[i],
-        "name": native_name,
-        "length": len(native_name),
-        "offset": offset,
-        "source_length": len(sources.modules[i]),
-    }
-    get_index_cases.append(GET_INDEX_CASE % d)
-    get_script_name_cases.append(GET_SCRIPT_NAME_CASE % d)
-    get_script_source_cases.append(GET_SCRIPT_SOURCE_CASE % d)
-    offset += len(sources.modules[i])
-  assert offset == len(raw_sources)
-
-  metadata = {
-    "builtin_count": len(sources.modules),
-    "sources_declaration": SOURCES_DECLARATION % ToCArray(source_bytes),
-    "total_length": total_length,
-    "get_index_cases": "".join(get_index_cases),
-    "get_script_source_cases": "".join(get_script_source_cases),
-    "get_script_name_cases": "".join(get_script_name_cases),
-    "type": native_type,
-  }
-  return metadata
+  filtered = [None] * len(source_files_and_contents)
+  if cache:
+    keys = [cache.Key(contents) for (_, contents) in source_files_and_contents]
+    filtered = [cache.Get(key) for key in keys]
+  stale = [source_files_and_contents[i]
+           for i in range(len(filtered)) if filtered[i] is None]
+
+  pool = None
+  if jobs > 1 and len(stale) > 1:
+    pool = multiprocessing.Pool(min(jobs, len(stale)))
+    results = pool.imap(FilterSource, stale)
+  else:
+    results = (FilterSource(s) for s in stale)
+  try:
+    for i in range(len(filtered)):
+      lines = filtered[i]
+      filtered[i] = None
+      if lines is None:
+        lines = next(results)
+        if cache:
+          cache.Put(keys[i], lines)
+      yield lines
+  finally:
+    if pool:
+      pool.terminate()
+      pool.join()
+  if cache:
+    cache.Prune()
 
 
 def PutInt(blob_file, value):
@@ -300,49 +355,96 @@ def PutInt(blob_file, value):
 
 
 def PutStr(blob_file, value):
+  value = value.encode("ascii")
   PutInt(blob_file, len(value));
   blob_file.write(value);
 
 
-def WriteStartupBlob(sources, startup_blob):
-  """Write a startup blob, as expected by V8 Initialize ...
-    TODO(vogelheim): Add proper method name.
+def JS2C(sources, target, native_type, raw_file, startup_blob, emit_js,
+         jobs=1, cache_dir=None):
+  """Filters the sources and writes them out as they become ready.
 
-  Args:
-    sources: A Sources instance with the prepared sources.
-    startup_blob_file: Name of file to write the blob to.
+  The C array, the raw file and the startup blob are written one source at
+  a time, so no output has to be assembled in memory.
   """
-  output = open(startup_blob, "wb")
-
-  PutInt(output, len(sources.names))
-  for i in range(len(sources.names)):
-    PutStr(output, sources.names[i]);
-    PutStr(output, sources.modules[i]);
-
-  output.close()
+  source_files_and_contents = [(f, ReadFile(f)) for f in sources]
 
+  # Have a single not-quite-empty source file if there are none present;
+  # otherwise you get errors trying to compile an empty C++ array.
+  # It cannot be empty (or whitespace, which gets trimmed to empty), as
+  # the deserialization code assumes each file is nonempty.
+  if not source_files_and_contents:
+    source_files_and_contents = [("dummy.js", "(function() {})")]
 
-def JS2C(sources, target, native_type, raw_file, startup_blob, emit_js):
-  prepared_sources = PrepareSources(sources, native_type, emit_js)
-  sources_output = "".join(prepared_sources.modules)
-  metadata = BuildMetadata(prepared_sources, sources_output, native_type)
-
-  # Optionally emit raw file.
-  if raw_file:
-    output = open(raw_file, "w")
-    output.write(sources_output)
-    output.close()
-
-  if startup_blob:
-    WriteStartupBlob(prepared_sources, startup_blob)
+  names = [os.path.basename(source)[:-3]
+           for (source, _) in source_files_and_contents]
+  cache = FilterCache(cache_dir) if cache_dir else None
 
-  # Emit resulting source file.
   output = open(target, "w")
-  if emit_js:
-    output.write(sources_output)
-  else:
-    output.write(HEADER_TEMPLATE % metadata)
-  output.close()
+  raw_output = open(raw_file, "w") if raw_file else None
+  blob_output = open(startup_blob, "wb") if startup_blob else None
+  outputs = [f for f in (output, raw_output, blob_output) if f]
+  try:
+    header, footer = HEADER_TEMPLATE.split("%(sources_declaration)s")
+    declaration_start, declaration_end = SOURCES_DECLARATION.split("%s")
+    if not emit_js:
+      output.write(header)
+      output.write(declaration_start)
+      sources_array = CArrayWriter(output)
+    if blob_output:
+      PutInt(blob_output, len(names))
+
+    # Build up indices into the source blob as the sources come in.
+    get_index_cases = []
+    get_script_name_cases = []
+    get_script_source_cases = []
+    offset = 0
+    filtered_sources = FilterSources(source_files_and_contents, jobs, cache)
+    for (i, lines) in enumerate(filtered_sources):
+      if emit_js:
+        output.write(lines)
+      else:
+        sources_array.Write(lines.encode("ascii"))
+      if raw_output:
+        raw_output.write(lines)
+      if blob_output:
+        PutStr(blob_output, names[i])
+        PutStr(blob_output, lines)
+
+      native_name = "native %s.js" % names[i]
+      d = {
+          "i": i,
+          "id": names[i],
+          "name": native_name,
+          "length": len(native_name),
+          "offset": offset,
+          "source_length": len(lines),
+      }
+      get_index_cases.append(GET_INDEX_CASE % d)
+      get_script_name_cases.append(GET_SCRIPT_NAME_CASE % d)
+      get_script_source_cases.append(GET_SCRIPT_SOURCE_CASE % d)
+      offset += len(lines)
+
+    if not emit_js:
+      sources_array.Close()
+      output.write(declaration_end)
+      metadata = {
+        "builtin_count": len(names),
+        "total_length": offset,
+        "get_index_cases": "".join(get_index_cases),
+        "get_script_source_cases": "".join(get_script_source_cases),
+        "get_script_name_cases": "".join(get_script_name_cases),
+        "type": native_type,
+      }
+      output.write(footer % metadata)
+  except:
+    # Do not leave partly written files behind for the build to pick up.
+    for f in outputs:
+      f.close()
+      os.remove(f.name)
+    raise
+  for f in outputs:
+    f.close()
 
 
 def main():
@@ -355,6 +457,11 @@ def main():
                     help="writes a JS file output instead of a C file",
                     action="store_true", default=False, dest='js')
   parser.add_option("--nojs", action="store_false", default=False, dest='js')
+  parser.add_option("--jobs", type="int", default=1,
+                    help="number of processes to filter the sources in.")
+  parser.add_option("--cache_dir",
+                    help="directory to keep filtered sources in, so that "
+                         "unchanged files are not filtered again.")
   parser.set_usage("""js2c out.cc type sources.js ...
         out.cc: C code to be generated.
         type: type parameter for NativesCollection template.
@@ -365,7 +472,9 @@ def main():
        args[1],
        options.raw,
        options.startup_blob,
-       options.js)
+       options.js,
+       options.jobs,
+       options.cache_dir)
 
 
 if __name__ == "__main__":
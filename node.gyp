@@ -5,6 +5,8 @@
     'v8_trace_maps%': 0,
     'node_use_dtrace%': 'false',
     'node_use_etw%': 'false',
+    'node_js2c_raw_strings%': 'false',
+    'node_js2c_compress%': 'false',
     'node_no_browser_globals%': 'false',
     'node_use_node_snapshot%': 'false',
     'node_use_v8_platform%': 'true',
@@ -553,6 +555,7 @@
         'src/node_task_queue.cc',
         'src/node_trace_events.cc',
         'src/node_types.cc',
+        'src/node_union_bytes.cc',
         'src/node_url.cc',
         'src/node_util.cc',
         'src/node_v8.cc',
@@ -882,7 +885,6 @@
             # Put the code first so it's a dependency and can be used for invocation.
             'tools/js2c.py',
             '<@(library_files)',
-            'config.gypi',
             'tools/js2c_macros/check_macros.py'
           ],
           'outputs': [
@@ -897,8 +899,32 @@
             }],
             [ 'node_debug_lib=="true"', {
               'inputs': [ 'tools/js2c_macros/dcheck_macros.py' ]
+            }],
+            [ 'node_js2c_raw_strings=="true"', {
+              'action': [ '--raw-string-literals' ]
+            }],
+            [ 'node_js2c_compress=="true"', {
+              'action': [ '--compress' ]
             }]
           ],
+          'action': [
+            'python', '<@(_inputs)',
+            '--target', '<@(_outputs)',
+            '--cache-dir', '<(SHARED_INTERMEDIATE_DIR)/js2c-cache',
+          ],
+        },
+        {
+          # config.gypi is kept out of node_javascript.cc, so that configure
+          # changes only regenerate this small file.
+          'action_name': 'node_js2c_config',
+          'process_outputs_as_sources': 1,
+          'inputs': [
+            'tools/js2c.py',
+            'config.gypi',
+          ],
+          'outputs': [
+            '<(SHARED_INTERMEDIATE_DIR)/node_javascript_config.cc',
+          ],
           'action': [
             'python', '<@(_inputs)',
             '--target', '<@(_outputs)',
@@ -1106,6 +1132,7 @@
         'test/cctest/test_per_process.cc',
         'test/cctest/test_platform.cc',
         'test/cctest/test_traced_value.cc',
+        'test/cctest/test_union_bytes.cc',
         'test/cctest/test_util.cc',
         'test/cctest/test_url.cc',
       ],
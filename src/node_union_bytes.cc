@@ -0,0 +1,28 @@
+#include "node_union_bytes.h"
+#include "util-inl.h"
+#include "zlib.h"
+
+namespace node {
+
+const void* CompressedBytes::Inflate() {
+  Mutex::ScopedLock lock(mutex_);
+  if (!inflated_) {
+    // Leave room for at least one unit so that empty sources still get a
+    // non-null pointer.
+    size_t units = byte_length_ / sizeof(uint16_t) + 1;
+    std::unique_ptr<uint16_t[]> inflated(new uint16_t[units]);
+    uLongf inflated_length = byte_length_;
+    int err = uncompress(reinterpret_cast<Bytef*>(inflated.get()),
+                         &inflated_length,
+                         data_,
+                         compressed_length_);
+    CHECK_EQ(err, Z_OK);
+    CHECK_EQ(inflated_length, byte_length_);
+    if (!is_one_byte_ && IsBigEndian())
+      SwapBytes16(reinterpret_cast<char*>(inflated.get()), byte_length_);
+    inflated_ = std::move(inflated);
+  }
+  return inflated_.get();
+}
+
+}  // namespace node
@@ -7,8 +7,11 @@
 // A union of const uint8_t* or const uint16_t* data that can be
 // turned into external v8::String when given an isolate.
 
+#include "node_mutex.h"
 #include "v8.h"
 
+#include <memory>
+
 namespace node {
 
 class NonOwningExternalOneByteResource
@@ -53,6 +56,37 @@ class NonOwningExternalTwoByteResource
   size_t length_;
 };
 
+// zlib-compressed data embedded by js2c.py --compress. It is inflated the
+// first time it is accessed and then kept for the lifetime of the process,
+// since external strings created from it may still refer to it.
+class CompressedBytes {
+ public:
+  CompressedBytes(const uint8_t* data,
+                  size_t compressed_length,
+                  size_t byte_length,
+                  bool is_one_byte)
+      : data_(data),
+        compressed_length_(compressed_length),
+        byte_length_(byte_length),
+        is_one_byte_(is_one_byte) {}
+
+  CompressedBytes(const CompressedBytes&) = delete;
+  CompressedBytes& operator=(const CompressedBytes&) = delete;
+
+  // Two-byte data is stored in little-endian order and swapped after
+  // inflation on big-endian hosts.
+  const void* Inflate();
+
+ private:
+  const uint8_t* data_;
+  size_t compressed_length_;
+  size_t byte_length_;
+  bool is_one_byte_;
+  Mutex mutex_;
+  // uint16_t keeps two-byte data aligned.
+  std::unique_ptr<uint16_t[]> inflated_;
+};
+
 // Similar to a v8::String, but it's independent from Isolates
 // and can be materialized in Isolates as external Strings
 // via ToStringChecked. The data pointers are owned by the caller.
@@ -62,6 +96,19 @@ class UnionBytes {
       : is_one_byte_(false), two_bytes_(data), length_(length) {}
   UnionBytes(const uint8_t* data, size_t length)
       : is_one_byte_(true), one_bytes_(data), length_(length) {}
+  // `length` is the number of code units once inflated.
+  UnionBytes(const uint8_t* compressed,
+             size_t compressed_length,
+             size_t length,
+             bool is_one_byte)
+      : is_one_byte_(is_one_byte),
+        one_bytes_(nullptr),
+        length_(length),
+        compressed_(std::make_shared<CompressedBytes>(
+            compressed,
+            compressed_length,
+            is_one_byte ? length : length * sizeof(uint16_t),
+            is_one_byte)) {}
 
   UnionBytes(const UnionBytes&) = default;
   UnionBytes& operator=(const UnionBytes&) = default;
@@ -71,24 +118,26 @@ class UnionBytes {
   bool is_one_byte() const { return is_one_byte_; }
   const uint16_t* two_bytes_data() const {
     CHECK(!is_one_byte_);
-    CHECK_NOT_NULL(two_bytes_);
-    return two_bytes_;
+    const uint16_t* data = compressed_ ?
+        static_cast<const uint16_t*>(compressed_->Inflate()) : two_bytes_;
+    CHECK_NOT_NULL(data);
+    return data;
   }
   const uint8_t* one_bytes_data() const {
     CHECK(is_one_byte_);
-    CHECK_NOT_NULL(one_bytes_);
-    return one_bytes_;
+    const uint8_t* data = compressed_ ?
+        static_cast<const uint8_t*>(compressed_->Inflate()) : one_bytes_;
+    CHECK_NOT_NULL(data);
+    return data;
   }
   v8::Local<v8::String> ToStringChecked(v8::Isolate* isolate) const {
     if (is_one_byte_) {
-      CHECK_NOT_NULL(one_bytes_);
       NonOwningExternalOneByteResource* source =
-          new NonOwningExternalOneByteResource(one_bytes_, length_);
+          new NonOwningExternalOneByteResource(one_bytes_data(), length_);
       return v8::String::NewExternalOneByte(isolate, source).ToLocalChecked();
     } else {
-      CHECK_NOT_NULL(two_bytes_);
       NonOwningExternalTwoByteResource* source =
-          new NonOwningExternalTwoByteResource(two_bytes_, length_);
+          new NonOwningExternalTwoByteResource(two_bytes_data(), length_);
       return v8::String::NewExternalTwoByte(isolate, source).ToLocalChecked();
     }
   }
@@ -101,6 +150,8 @@ class UnionBytes {
     const uint16_t* two_bytes_;
   };
   size_t length_;
+  // Shared by all copies, so that the data is only inflated once.
+  std::shared_ptr<CompressedBytes> compressed_;
 };
 
 }  // namespace node
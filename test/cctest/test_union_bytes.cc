@@ -0,0 +1,62 @@
+#include "node_union_bytes.h"
+#include "util-inl.h"
+#include "zlib.h"
+
+#include "gtest/gtest.h"
+
+#include <string>
+#include <vector>
+
+using node::UnionBytes;
+
+namespace {
+
+std::vector<uint8_t> Compress(const void* data, size_t length) {
+  uLongf compressed_length = compressBound(length);
+  std::vector<uint8_t> compressed(compressed_length);
+  EXPECT_EQ(compress(compressed.data(), &compressed_length,
+                     static_cast<const Bytef*>(data), length), Z_OK);
+  compressed.resize(compressed_length);
+  return compressed;
+}
+
+TEST(UnionBytesTest, CompressedOneByte) {
+  const std::string source = "'use strict';\nmodule.exports = 42;\n";
+  std::vector<uint8_t> compressed = Compress(source.data(), source.size());
+  UnionBytes bytes(compressed.data(), compressed.size(), source.size(), true);
+  UnionBytes copy = bytes;
+
+  EXPECT_TRUE(bytes.is_one_byte());
+  EXPECT_EQ(bytes.length(), source.size());
+  const uint8_t* data = bytes.one_bytes_data();
+  EXPECT_EQ(std::string(reinterpret_cast<const char*>(data), source.size()),
+            source);
+  // Copies share the inflated data.
+  EXPECT_EQ(copy.one_bytes_data(), data);
+}
+
+TEST(UnionBytesTest, CompressedTwoByte) {
+  const std::vector<uint16_t> source = { 0x27, 0x20ac, 0x27, 0x3b, 0xd83d,
+                                         0xde00 };
+  // js2c.py compresses two-byte sources as little-endian UTF-16.
+  std::vector<uint8_t> encoded;
+  for (uint16_t unit : source) {
+    encoded.push_back(unit & 0xff);
+    encoded.push_back(unit >> 8);
+  }
+  std::vector<uint8_t> compressed = Compress(encoded.data(), encoded.size());
+  UnionBytes bytes(compressed.data(), compressed.size(), source.size(), false);
+
+  EXPECT_FALSE(bytes.is_one_byte());
+  EXPECT_EQ(bytes.length(), source.size());
+  const uint16_t* data = bytes.two_bytes_data();
+  EXPECT_EQ(std::vector<uint16_t>(data, data + source.size()), source);
+}
+
+TEST(UnionBytesTest, CompressedEmpty) {
+  std::vector<uint8_t> compressed = Compress("", 0);
+  UnionBytes bytes(compressed.data(), compressed.size(), 0, true);
+  EXPECT_NE(bytes.one_bytes_data(), nullptr);
+}
+
+}  // namespace
@@ -28,11 +28,94 @@
 import test
 import os
 import re
+import json
+import time
 from functools import reduce
 
 
 FLAGS_PATTERN = re.compile(r"//\s+Flags:(.*)")
 LS_RE = re.compile(r'^test-.*\.m?js$')
+# Some filesystems only keep mtimes to the second, or to two seconds on FAT.
+MTIME_RESOLUTION = 2
+
+
+class TestIndex(object):
+  """A persistent index of a suite's test files.
+
+  Directory listings are reused for as long as the directory's mtime is
+  unchanged, and the `// Flags:` header of a test is only parsed again when
+  the file's mtime or size changes. An entry read within MTIME_RESOLUTION of
+  the mtime it recorded is read again, since a change made right after it
+  may have left the mtime as it was. Every file is checked at most once per
+  run; later lookups are served from memory."""
+
+  def __init__(self, path):
+    self.path = path
+    self.dirs = {}
+    self.files = {}
+    self.checked = set()
+    self.dirty = False
+    try:
+      with open(path) as f:
+        data = json.load(f)
+      self.dirs = data['dirs']
+      self.files = data['files']
+    except (IOError, OSError, ValueError, KeyError):
+      pass
+
+  @staticmethod
+  def IsSettled(entry, mtime):
+    """Whether |entry|, which starts with the mtime it was read at and when it
+    was read, still describes something whose mtime is |mtime|."""
+    return entry[0] == mtime and entry[1] - mtime >= MTIME_RESOLUTION
+
+  def ListDir(self, path):
+    """Returns [name, is_dir] pairs for the entries of |path|."""
+    mtime = os.stat(path).st_mtime
+    entry = self.dirs.get(path)
+    if entry is None or len(entry) != 3 or not self.IsSettled(entry, mtime):
+      read_at = time.time()
+      entries = [[name, os.path.isdir(os.path.join(path, name))]
+                 for name in os.listdir(path)]
+      entry = [mtime, read_at, entries]
+      self.dirs[path] = entry
+      self.dirty = True
+    return entry[2]
+
+  def GetFlags(self, file):
+    """Returns the flags from the `// Flags:` header of |file|, or None."""
+    entry = self.files.get(file)
+    if file not in self.checked:
+      self.checked.add(file)
+      stat = os.stat(file)
+      if (entry is None or len(entry) != 4 or
+          not self.IsSettled(entry, stat.st_mtime) or
+          entry[2] != stat.st_size):
+        read_at = time.time()
+        flags_match = FLAGS_PATTERN.search(open(file).read())
+        flags = flags_match.group(1).strip().split() if flags_match else None
+        entry = [stat.st_mtime, read_at, stat.st_size, flags]
+        self.files[file] = entry
+        self.dirty = True
+    return entry[3]
+
+  def Save(self):
+    if not self.dirty:
+      return
+    try:
+      directory = os.path.dirname(self.path)
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+      temp = self.path + '.tmp'
+      with open(temp, 'w') as f:
+        json.dump({'dirs': self.dirs, 'files': self.files}, f)
+      if os.path.exists(self.path):
+        os.unlink(self.path)
+      os.rename(temp, self.path)
+      self.dirty = False
+    except (IOError, OSError) as e:
+      print("Could not save the test index %s: %s" % (self.path, e))
+
 
 class SimpleTestCase(test.TestCase):
 
@@ -56,10 +139,8 @@ class SimpleTestCase(test.TestCase):
 
   def GetCommand(self):
     result = [self.config.context.GetVm(self.arch, self.mode)]
-    source = open(self.file).read()
-    flags_match = FLAGS_PATTERN.search(source)
-    if flags_match:
-      flags = flags_match.group(1).strip().split()
+    flags = self.config.index.GetFlags(self.file)
+    if flags is not None:
       # The following block reads config.gypi to extract the v8_enable_inspector
       # value. This is done to check if the inspector is disabled in which case
       # the '--inspect' flag cannot be passed to the node process as it will
@@ -99,9 +180,11 @@ class SimpleTestConfiguration(test.TestConfiguration):
       self.additional_flags = additional
     else:
       self.additional_flags = []
+    self.index = TestIndex(os.path.join(context.workspace, 'out', 'testpy',
+                                        os.path.basename(root) + '.json'))
 
   def Ls(self, path):
-    return [f for f in os.listdir(path) if LS_RE.match(f)]
+    return [f for f, is_dir in self.index.ListDir(path) if LS_RE.match(f)]
 
   def ListTests(self, current_path, path, arch, mode):
     all_tests = [current_path + [t] for t in self.Ls(os.path.join(self.root))]
@@ -110,8 +193,10 @@ class SimpleTestConfiguration(test.TestConfiguration):
       if self.Contains(path, tst):
         file_path = os.path.join(self.root, reduce(os.path.join, tst[1:], ""))
         test_name = tst[:-1] + [os.path.splitext(tst[-1])[0]]
+        self.index.GetFlags(file_path)
         result.append(SimpleTestCase(test_name, file_path, arch, mode,
                                      self.context, self, self.additional_flags))
+    self.index.Save()
     return result
 
   def GetBuildRequirements(self):
@@ -138,9 +223,9 @@ class AddonTestConfiguration(SimpleTestConfiguration):
       return name.endswith('.js')
 
     result = []
-    for subpath in os.listdir(path):
-      if os.path.isdir(os.path.join(path, subpath)):
-        for f in os.listdir(os.path.join(path, subpath)):
+    for subpath, is_dir in self.index.ListDir(path):
+      if is_dir:
+        for f, _ in self.index.ListDir(os.path.join(path, subpath)):
           if SelectTest(f):
             result.append([subpath, f[:-3]])
     return result
@@ -151,8 +236,10 @@ class AddonTestConfiguration(SimpleTestConfiguration):
     for tst in all_tests:
       if self.Contains(path, tst):
         file_path = os.path.join(self.root, reduce(os.path.join, tst[1:], "") + ".js")
+        self.index.GetFlags(file_path)
         result.append(
             SimpleTestCase(tst, file_path, arch, mode, self.context, self, self.additional_flags))
+    self.index.Save()
     return result
 
 class AbortTestConfiguration(SimpleTestConfiguration):
@@ -2,19 +2,22 @@
 
 from __future__ import print_function
 import glob
+import hashlib
+import json
+import os
 import re
 import sys
 
 
-def do_exist(file_name, lines, imported):
+def do_exist(file_name, lines, imported, messages):
   if not any(not re.match('using \w+::{0};'.format(imported), line) and
              re.search(imported, line) for line in lines):
-    print('File "{0}" does not use "{1}"'.format(file_name, imported))
+    messages.append('File "{0}" does not use "{1}"'.format(file_name, imported))
     return False
   return True
 
 
-def is_valid(file_name):
+def is_valid(file_name, messages):
   with open(file_name) as source_file:
     lines = [line.strip() for line in source_file]
 
@@ -26,17 +29,83 @@ def is_valid(file_name):
       usings.append(matches.group(1))
       importeds.append(matches.group(2))
 
-  valid = all([do_exist(file_name, lines, imported) for imported in importeds])
+  valid = all([do_exist(file_name, lines, imported, messages)
+               for imported in importeds])
 
   sorted_usings = sorted(usings, key=lambda x: x.lower())
   if sorted_usings != usings:
-    print("using statements aren't sorted in '{0}'.".format(file_name))
+    messages.append("using statements aren't sorted in '{0}'."
+        .format(file_name))
     for num, actual, expected in zip(line_numbers, usings, sorted_usings):
       if actual != expected:
-        print('\tLine {0}: Actual: {1}, Expected: {2}'
+        messages.append('\tLine {0}: Actual: {1}, Expected: {2}'
             .format(num, actual, expected))
     return False
   else:
     return valid
 
-sys.exit(0 if all(map(is_valid, glob.iglob('src/*.cc'))) else 1)
+
+class ResultCache(object):
+  """Remembers the result for each file by a hash of its contents and of
+  this script, so that unchanged files are not checked again."""
+
+  def __init__(self, path):
+    self.path = path
+    self.files = {}
+    self.changed = False
+    with open(__file__.rstrip('c'), 'rb') as script:
+      self.version = hashlib.sha1(script.read()).hexdigest()
+    try:
+      with open(path) as cache_file:
+        data = json.load(cache_file)
+      if data['version'] == self.version:
+        self.files = data['files']
+    except (IOError, OSError, ValueError, KeyError):
+      pass
+
+  def check(self, file_name):
+    with open(file_name, 'rb') as source_file:
+      digest = hashlib.sha1(source_file.read()).hexdigest()
+    entry = self.files.get(file_name)
+    if entry and entry[0] == digest:
+      valid, messages = entry[1], entry[2]
+    else:
+      messages = []
+      valid = is_valid(file_name, messages)
+      self.files[file_name] = [digest, valid, messages]
+      self.changed = True
+    return valid, messages
+
+  def save(self):
+    if not self.changed:
+      return
+    directory = os.path.dirname(self.path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    with open(self.path, 'w') as cache_file:
+      json.dump({'version': self.version, 'files': self.files}, cache_file)
+
+
+def check(file_name, cache):
+  if cache:
+    valid, messages = cache.check(file_name)
+  else:
+    messages = []
+    valid = is_valid(file_name, messages)
+  for message in messages:
+    print(message)
+  return valid
+
+
+if __name__ == '__main__':
+  cache = None
+  for arg in sys.argv[1:]:
+    if arg.startswith('--cache='):
+      cache = ResultCache(arg[len('--cache='):])
+  try:
+    ok = all([check(file_name, cache)
+              for file_name in glob.iglob('src/*.cc')])
+  finally:
+    if cache:
+      cache.save()
+  sys.exit(0 if ok else 1)
@@ -45,14 +45,18 @@ import codecs
 import copy
 import getopt
 import glob
+import hashlib
 import itertools
+import json
 import math  # for log
+import multiprocessing
 import os
 import re
 import sre_compile
 import string
 import sys
 import sysconfig
+import timeit
 import unicodedata
 import xml.etree.ElementTree
 
@@ -78,6 +82,7 @@ Syntax: cpplint.py [--verbose=#] [--output=emacs|eclipse|vs7|junit]
                    [--exclude=path]
                    [--extensions=hpp,cpp,...]
                    [--quiet]
+                   [--jobs=#] [--cache=path] [--profile-checks]
                    [--version]
         <file> [file] ...
 
@@ -219,6 +224,28 @@ Syntax: cpplint.py [--verbose=#] [--output=emacs|eclipse|vs7|junit]
         --headers=hpp,hxx
         --headers=hpp
 
+    jobs=#
+      Lint files in this many processes at once. Output is still written in
+      the order the files were given, and error counts are the same as for a
+      single process.
+
+      Examples:
+        --jobs=8
+
+    cache=path
+      Keep the result of linting each file in this file. A file whose
+      contents, neighbouring headers and .cpplint files have not changed
+      since the last run with the same options and the same cpplint is not
+      linted again; its stored output is printed instead.
+
+      Examples:
+        --cache=out/cpplint-cache.json
+
+    profile-checks
+      Time each check and print how long the checks took in total, slowest
+      first, to stderr. Files are linted in this process and --jobs and
+      --cache are ignored.
+
     cpplint.py supports per-directory configurations specified in CPPLINT.cfg
     files. CPPLINT.cfg file can contain a number of key=value pairs.
     Currently the following options are supported:
@@ -653,6 +680,18 @@ _excludes = None
 # Whether to suppress PrintInfo messages
 _quiet = False
 
+# The number of processes used to lint files. This is set by the --jobs flag.
+_jobs = 1
+
+# Settings restored before linting each file. See _LintFile.
+_worker_settings = None
+
+# The file that stores lint results across runs. This is set by --cache.
+_cache_file = None
+
+# Whether to time each check. This is set by the --profile-checks flag.
+_profile_checks = False
+
 # The allowed line length of files.
 # This is set by --linelength flag.
 _line_length = 80
@@ -1004,6 +1043,14 @@ class _IncludeState(object):
 class _CppLintState(object):
   """Maintains module-wide state.."""
 
+  # Maps a tuple of filters to a dict from category to whether those filters
+  # suppress it, so that each category is checked against each filter list
+  # only once.
+  _FILTER_DECISIONS = {}
+  # Maps a tuple of filters and a string of filters added to it to the
+  # resulting list, as most files add the same .cpplint filters.
+  _ADDED_FILTERS = {}
+
   def __init__(self):
     self.verbose_level = 1  # global setting.
     self.error_count = 0    # global count of reported errors
@@ -1011,6 +1058,7 @@ class _CppLintState(object):
     self.filters = _DEFAULT_FILTERS[:]
     # backup of filter list. Used to restore the state after each file.
     self._filters_backup = self.filters[:]
+    self._FiltersChanged()
     self.counting = 'total'  # In what way are we counting errors?
     self.errors_by_category = {}  # string to int dict storing error counts
     self.quiet = False  # Suppress non-error messagess?
@@ -1067,14 +1115,20 @@ class _CppLintState(object):
 
   def AddFilters(self, filters):
     """ Adds more filters to the existing list of error-message filters. """
-    for filt in filters.split(','):
-      clean_filt = filt.strip()
-      if clean_filt:
-        self.filters.append(clean_filt)
-    for filt in self.filters:
-      if not (filt.startswith('+') or filt.startswith('-')):
-        raise ValueError('Every filter in --filters must start with + or -'
-                         ' (%s does not)' % filt)
+    key = (tuple(self.filters), filters)
+    added = self._ADDED_FILTERS.get(key)
+    if added is None:
+      for filt in filters.split(','):
+        clean_filt = filt.strip()
+        if clean_filt:
+          self.filters.append(clean_filt)
+      for filt in self.filters:
+        if not (filt.startswith('+') or filt.startswith('-')):
+          raise ValueError('Every filter in --filters must start with + or -'
+                           ' (%s does not)' % filt)
+      added = self._ADDED_FILTERS[key] = self.filters[:]
+    self.filters = added[:]
+    self._FiltersChanged()
 
   def BackupFilters(self):
     """ Saves the current filter list to backup storage."""
@@ -1083,6 +1137,28 @@ class _CppLintState(object):
   def RestoreFilters(self):
     """ Restores filters previously backed up."""
     self.filters = self._filters_backup[:]
+    self._FiltersChanged()
+
+  def _FiltersChanged(self):
+    self._filter_decisions = self._FILTER_DECISIONS.setdefault(
+        tuple(self.filters), {})
+
+  def IsFiltered(self, category):
+    """Returns whether the filters suppress errors in the given category."""
+    is_filtered = self._filter_decisions.get(category)
+    if is_filtered is None:
+      is_filtered = False
+      for one_filter in self.filters:
+        if one_filter.startswith('-'):
+          if category.startswith(one_filter[1:]):
+            is_filtered = True
+        elif one_filter.startswith('+'):
+          if category.startswith(one_filter[1:]):
+            is_filtered = False
+        else:
+          assert False  # should have been checked for in SetFilter.
+      self._filter_decisions[category] = is_filtered
+    return is_filtered
 
   def ResetErrorCounts(self):
     """Sets the module's error statistic back to zero."""
@@ -1419,17 +1495,7 @@ def _ShouldPrintError(category, confidence, linenum):
   if confidence < _cpplint_state.verbose_level:
     return False
 
-  is_filtered = False
-  for one_filter in _Filters():
-    if one_filter.startswith('-'):
-      if category.startswith(one_filter[1:]):
-        is_filtered = True
-    elif one_filter.startswith('+'):
-      if category.startswith(one_filter[1:]):
-        is_filtered = False
-    else:
-      assert False  # should have been checked for in SetFilter.
-  if is_filtered:
+  if _cpplint_state.IsFiltered(category):
     return False
 
   return True
@@ -1668,11 +1734,20 @@ class CleansedLines(object):
           self.lines_without_raw_strings[linenum]))
       elided = self._CollapseStrings(self.lines_without_raw_strings[linenum])
       self.elided.append(CleanseComments(elided))
+    self._triggered_checks = {}
 
   def NumLines(self):
     """Returns the number of lines represented."""
     return self.num_lines
 
+  def TriggeredChecks(self, linenum):
+    """Returns the checks in _CHECK_TRIGGERS that need to run on a line."""
+    checks = self._triggered_checks.get(linenum)
+    if checks is None:
+      checks = _TriggeredChecks(self.elided[linenum])
+      self._triggered_checks[linenum] = checks
+    return checks
+
   @staticmethod
   def _CollapseStrings(elided):
     """Collapses strings and chars on a line to simple "" or '' blocks.
@@ -4569,6 +4644,10 @@ def CheckLeftLeaningPointer(filename, clean_lines, linenum, error):
     error(filename, linenum, 'readability/pointer_notation', 2,
           'Use left leaning pointer instead of right leaning')
 
+
+_RE_PATTERN_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
 def GetLineWidth(line):
   """Determines the width of the line in column positions.
 
@@ -4580,6 +4659,9 @@ def GetLineWidth(line):
     combining characters and wide characters.
   """
   if isinstance(line, unicode):
+    # Every ASCII character takes up exactly one column.
+    if not _RE_PATTERN_NON_ASCII.search(line):
+      return len(line)
     width = 0
     for uc in unicodedata.normalize('NFC', line):
       if unicodedata.east_asian_width(uc) in ('W', 'F'):
@@ -4720,10 +4802,15 @@ def CheckStyle(filename, clean_lines, linenum, file_extension, nesting_state,
   CheckCommaSpacing(filename, clean_lines, linenum, error)
   CheckBracesSpacing(filename, clean_lines, linenum, nesting_state, error)
   CheckSpacingForFunctionCall(filename, clean_lines, linenum, error)
-  CheckCheck(filename, clean_lines, linenum, error)
-  CheckAltTokens(filename, clean_lines, linenum, error)
-  CheckNullTokens(filename, clean_lines, linenum, error)
-  CheckLeftLeaningPointer(filename, clean_lines, linenum, error)
+  triggered = clean_lines.TriggeredChecks(linenum)
+  if 'CheckCheck' in triggered:
+    CheckCheck(filename, clean_lines, linenum, error)
+  if 'CheckAltTokens' in triggered:
+    CheckAltTokens(filename, clean_lines, linenum, error)
+  if 'CheckNullTokens' in triggered:
+    CheckNullTokens(filename, clean_lines, linenum, error)
+  if 'CheckLeftLeaningPointer' in triggered:
+    CheckLeftLeaningPointer(filename, clean_lines, linenum, error)
   classinfo = nesting_state.InnermostClass()
   if classinfo:
     CheckSectionSpacing(filename, clean_lines, classinfo, linenum, error)
@@ -6098,6 +6185,39 @@ def CheckItemIndentationInNamespace(filename, raw_lines_no_comments, linenum,
           'Do not indent within a namespace')
 
 
+# Checks that can only report an error on a line whose elided text contains
+# one of these tokens, so they are skipped on all other lines.  Most lines
+# contain none of them, which a single search for all tokens finds out.
+_CHECK_TRIGGERS = {
+    'CheckAltTokens': list(_ALT_TOKEN_REPLACEMENT),
+    'CheckCheck': _CHECK_MACROS,
+    'CheckLeftLeaningPointer': ['*'],
+    'CheckMakePairUsesDeduction': ['make_pair'],
+    'CheckNullTokens': ['NULL'],
+    'CheckPosixThreading': [func for func, _, _ in _THREADING_LIST],
+    'CheckRedundantOverrideOrFinal': ['override'],
+    'CheckRedundantVirtual': ['virtual'],
+    'CheckVlogArguments': ['VLOG('],
+}
+
+_CHECK_TRIGGER_PATTERNS = [
+    (check, re.compile('|'.join(re.escape(token) for token in tokens)))
+    for check, tokens in sorted(_CHECK_TRIGGERS.items())]
+
+_RE_PATTERN_ANY_CHECK_TRIGGER = re.compile('|'.join(
+    pattern.pattern for _, pattern in _CHECK_TRIGGER_PATTERNS))
+
+_NO_TRIGGERED_CHECKS = frozenset()
+
+
+def _TriggeredChecks(line):
+  """Returns the checks in _CHECK_TRIGGERS whose tokens appear in a line."""
+  if not _RE_PATTERN_ANY_CHECK_TRIGGER.search(line):
+    return _NO_TRIGGERED_CHECKS
+  return frozenset(check for check, pattern in _CHECK_TRIGGER_PATTERNS
+                   if pattern.search(line))
+
+
 def ProcessLine(filename, file_extension, clean_lines, line,
                 include_state, function_state, nesting_state, error,
                 extra_check_functions=None):
@@ -6133,12 +6253,18 @@ def ProcessLine(filename, file_extension, clean_lines, line,
   CheckForNonConstReference(filename, clean_lines, line, nesting_state, error)
   CheckForNonStandardConstructs(filename, clean_lines, line,
                                 nesting_state, error)
-  CheckVlogArguments(filename, clean_lines, line, error)
-  CheckPosixThreading(filename, clean_lines, line, error)
+  triggered = clean_lines.TriggeredChecks(line)
+  if 'CheckVlogArguments' in triggered:
+    CheckVlogArguments(filename, clean_lines, line, error)
+  if 'CheckPosixThreading' in triggered:
+    CheckPosixThreading(filename, clean_lines, line, error)
   CheckInvalidIncrement(filename, clean_lines, line, error)
-  CheckMakePairUsesDeduction(filename, clean_lines, line, error)
-  CheckRedundantVirtual(filename, clean_lines, line, error)
-  CheckRedundantOverrideOrFinal(filename, clean_lines, line, error)
+  if 'CheckMakePairUsesDeduction' in triggered:
+    CheckMakePairUsesDeduction(filename, clean_lines, line, error)
+  if 'CheckRedundantVirtual' in triggered:
+    CheckRedundantVirtual(filename, clean_lines, line, error)
+  if 'CheckRedundantOverrideOrFinal' in triggered:
+    CheckRedundantOverrideOrFinal(filename, clean_lines, line, error)
   if extra_check_functions:
     for check_fn in extra_check_functions:
       check_fn(filename, clean_lines, line, error)
@@ -6253,7 +6379,10 @@ def ProcessFileData(filename, file_extension, lines, error,
     FlagCxx11Features(filename, clean_lines, line, error)
   nesting_state.CheckCompletedBlocks(filename, error)
 
-  CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error)
+  # This check only reports one category, and reads the headers the file
+  # includes to do so, so skip it if that category is filtered out.
+  if not _cpplint_state.IsFiltered('build/include_what_you_use'):
+    CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error)
 
   # Check that the .cc file has included its header if it exists.
   if _IsSourceExtension(file_extension):
@@ -6267,6 +6396,66 @@ def ProcessFileData(filename, file_extension, lines, error,
 
   CheckInlineHeader(filename, include_state, error)
 
+# Maps a directory to the .cpplint files that apply to the files in it, as
+# returned by _ConfigFiles.
+_config_files_cache = {}
+
+
+def _ReadConfigFile(cfg_file):
+  """Reads a .cpplint file.
+
+  Returns:
+    A list of (name, value) pairs, or None if the file could not be read.
+  """
+  entries = []
+  try:
+    with open(cfg_file) as file_handle:
+      for line in file_handle:
+        line, _, _ = line.partition('#')  # Remove comments.
+        if not line.strip():
+          continue
+
+        name, _, val = line.partition('=')
+        entries.append((name.strip(), val.strip()))
+  except IOError:
+    return None
+  return entries
+
+
+def _ConfigFiles(directory):
+  """Returns the .cpplint files that apply to the files in a directory.
+
+  Each directory is resolved once: its own .cpplint file, if any, is read and
+  the rest of the list is shared with its parent directory, unless the file
+  says "set noparent" or could not be read.
+
+  Args:
+    directory: An absolute path.
+
+  Returns:
+    A list of (directory, .cpplint path, entries) tuples, nearest first, where
+    entries is as returned by _ReadConfigFile.
+  """
+  config_files = _config_files_cache.get(directory)
+  if config_files is not None:
+    return config_files
+
+  config_files = []
+  keep_looking = True
+  cfg_file = os.path.join(directory, ".cpplint")
+  if os.path.isfile(cfg_file):
+    entries = _ReadConfigFile(cfg_file)
+    config_files.append((directory, cfg_file, entries))
+    keep_looking = entries is not None and not any(
+        name == 'set noparent' for name, _ in entries)
+
+  parent = os.path.dirname(directory)
+  if keep_looking and parent != directory:
+    config_files = config_files + _ConfigFiles(parent)
+  _config_files_cache[directory] = config_files
+  return config_files
+
+
 def ProcessConfigOverrides(filename):
   """ Loads the configuration files and processes the config overrides.
 
@@ -6279,79 +6468,65 @@ def ProcessConfigOverrides(filename):
 
   abs_filename = os.path.abspath(filename)
   cfg_filters = []
-  keep_looking = True
-  while keep_looking:
-    abs_path, base_name = os.path.split(abs_filename)
-    if not base_name:
-      break  # Reached the root directory.
-
-    cfg_file = os.path.join(abs_path, ".cpplint")
-    abs_filename = abs_path
-    if not os.path.isfile(cfg_file):
-      continue
-
-    try:
-      with open(cfg_file) as file_handle:
-        for line in file_handle:
-          line, _, _ = line.partition('#')  # Remove comments.
-          if not line.strip():
-            continue
-
-          name, _, val = line.partition('=')
-          name = name.strip()
-          val = val.strip()
-          if name == 'set noparent':
-            keep_looking = False
-          elif name == 'filter':
-            cfg_filters.append(val)
-          elif name == 'exclude_files':
-            # When matching exclude_files pattern, use the base_name of
-            # the current file name or the directory name we are processing.
-            # For example, if we are checking for lint errors in /foo/bar/baz.cc
-            # and we found the .cfg file at /foo/CPPLINT.cfg, then the config
-            # file's "exclude_files" filter is meant to be checked against "bar"
-            # and not "baz" nor "bar/baz.cc".
-            if base_name:
-              pattern = re.compile(val)
-              if pattern.match(base_name):
-                if _cpplint_state.quiet:
-                  # Suppress "Ignoring file" warning when using --quiet.
-                  return False
-                _cpplint_state.PrintInfo('Ignoring "%s": file excluded by "%s". '
-                                 'File path component "%s" matches '
-                                 'pattern "%s"\n' %
-                                 (filename, cfg_file, base_name, val))
-                return False
-          elif name == 'linelength':
-            global _line_length
-            try:
-              _line_length = int(val)
-            except ValueError:
-              _cpplint_state.PrintError('Line length must be numeric.')
-          elif name == 'extensions':
-            global _valid_extensions
-            try:
-              extensions = [ext.strip() for ext in val.split(',')]
-              _valid_extensions = set(extensions)
-            except ValueError:
-              sys.stderr.write('Extensions should be a comma-separated list of values;'
-                               'for example: extensions=hpp,cpp\n'
-                               'This could not be parsed: "%s"' % (val,))
-          elif name == 'root':
-            global _root
-            # root directories are specified relative to CPPLINT.cfg dir.
-            _root = os.path.join(os.path.dirname(cfg_file), val)
-          elif name == 'headers':
-            ProcessHppHeadersOption(val)
-          else:
-            _cpplint_state.PrintError(
-                'Invalid configuration option (%s) in file %s\n' %
-                (name, cfg_file))
-
-    except IOError:
+  for directory, cfg_file, entries in _ConfigFiles(
+      os.path.dirname(abs_filename)):
+    if entries is None:
       _cpplint_state.PrintError(
           "Skipping config file '%s': Can't open for reading\n" % cfg_file)
-      keep_looking = False
+      break
+
+    # The first path component below the directory of the .cpplint file.
+    base_name = abs_filename[len(directory):].lstrip(os.path.sep)
+    base_name = base_name.split(os.path.sep)[0]
+
+    for name, val in entries:
+      if name == 'set noparent':
+        pass
+      elif name == 'filter':
+        cfg_filters.append(val)
+      elif name == 'exclude_files':
+        # When matching exclude_files pattern, use the base_name of
+        # the current file name or the directory name we are processing.
+        # For example, if we are checking for lint errors in /foo/bar/baz.cc
+        # and we found the .cfg file at /foo/CPPLINT.cfg, then the config
+        # file's "exclude_files" filter is meant to be checked against "bar"
+        # and not "baz" nor "bar/baz.cc".
+        if base_name:
+          pattern = re.compile(val)
+          if pattern.match(base_name):
+            if _cpplint_state.quiet:
+              # Suppress "Ignoring file" warning when using --quiet.
+              return False
+            _cpplint_state.PrintInfo('Ignoring "%s": file excluded by "%s". '
+                             'File path component "%s" matches '
+                             'pattern "%s"\n' %
+                             (filename, cfg_file, base_name, val))
+            return False
+      elif name == 'linelength':
+        global _line_length
+        try:
+          _line_length = int(val)
+        except ValueError:
+          _cpplint_state.PrintError('Line length must be numeric.')
+      elif name == 'extensions':
+        global _valid_extensions
+        try:
+          extensions = [ext.strip() for ext in val.split(',')]
+          _valid_extensions = set(extensions)
+        except ValueError:
+          sys.stderr.write('Extensions should be a comma-separated list of values;'
+                           'for example: extensions=hpp,cpp\n'
+                           'This could not be parsed: "%s"' % (val,))
+      elif name == 'root':
+        global _root
+        # root directories are specified relative to CPPLINT.cfg dir.
+        _root = os.path.join(os.path.dirname(cfg_file), val)
+      elif name == 'headers':
+        ProcessHppHeadersOption(val)
+      else:
+        _cpplint_state.PrintError(
+            'Invalid configuration option (%s) in file %s\n' %
+            (name, cfg_file))
 
   # Apply all the accumulated filters in reverse order (top-level directory
   # config options having the least priority).
@@ -6508,6 +6683,9 @@ def ParseArguments(args):
                                                  'exclude=',
                                                  'recursive',
                                                  'headers=',
+                                                 'jobs=',
+                                                 'cache=',
+                                                 'profile-checks',
                                                  'quiet'])
   except getopt.GetoptError:
     PrintUsage('Invalid arguments.')
@@ -6568,6 +6746,20 @@ def ParseArguments(args):
       ProcessHppHeadersOption(val)
     elif opt == '--recursive':
       recursive = True
+    elif opt == '--jobs':
+      global _jobs
+      try:
+        _jobs = int(val)
+      except ValueError:
+        PrintUsage('Jobs must be digits.')
+      if _jobs < 1:
+        PrintUsage('Jobs must be at least 1.')
+    elif opt == '--cache':
+      global _cache_file
+      _cache_file = val
+    elif opt == '--profile-checks':
+      global _profile_checks
+      _profile_checks = True
 
   if not filenames:
     PrintUsage('No files were specified.')
@@ -6625,6 +6817,294 @@ def _FilterExcludedFiles(filenames):
   exclude_paths = [os.path.abspath(f) for f in _excludes]
   return [f for f in filenames if os.path.abspath(f) not in exclude_paths]
 
+class _CheckProfiler(object):
+  """Times the check functions for --profile-checks.
+
+  The time spent in checks called from another check is only counted for the
+  inner check, so the times add up to the total time spent checking.
+  """
+
+  def __init__(self):
+    self.stats = {}  # check name to [calls, seconds]
+    self.children = [0.0]  # time spent in nested checks, per level
+
+  def Install(self):
+    """Replaces the checks in the module with versions that time them."""
+    module = globals()
+    for name in sorted(module):
+      if (name.startswith('Check') or name.startswith('Flag') or
+          name == 'ProcessLine') and callable(module[name]):
+        module[name] = self._Timed(name, module[name])
+
+  def _Timed(self, name, check):
+    stats = self.stats.setdefault(name, [0, 0.0])
+    children = self.children
+
+    def timed(*args, **kwargs):
+      children.append(0.0)
+      start = timeit.default_timer()
+      try:
+        return check(*args, **kwargs)
+      finally:
+        elapsed = timeit.default_timer() - start
+        stats[0] += 1
+        stats[1] += elapsed - children.pop()
+        children[-1] += elapsed
+    return timed
+
+  def Print(self):
+    total = sum(seconds for _, seconds in self.stats.values()) or 1.0
+    sys.stderr.write('Time spent in checks:\n')
+    for name, (calls, seconds) in sorted(
+        iteritems(self.stats), key=lambda item: -item[1][1]):
+      if calls:
+        sys.stderr.write('  %-40s %8d calls %8.3fs %5.1f%%\n' % (
+            name, calls, seconds, 100 * seconds / total))
+
+
+class LintResultCache(object):
+  """Stores the result of linting each file across runs.
+
+  An entry is only used if the file, the headers next to it or of its module
+  and the .cpplint files above it still have the same contents, and cpplint and its settings
+  have not changed.  A file that is unchanged since the last run replays its
+  stored output instead of being linted again.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.files = {}
+    self.changed = False
+    self.settings = _SettingsFingerprint()
+    try:
+      with open(path) as cache_file:
+        self.files = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+      pass
+
+  def Key(self, filename):
+    """Returns the cache key for |filename|, or None if it can't be cached."""
+    if filename == '-':
+      return None
+    digest = hashlib.sha1(self.settings)
+    for path in _LintInputs(filename):
+      digest.update(path.encode('utf-8') + b'\0')
+      try:
+        with open(path, 'rb') as input_file:
+          digest.update(input_file.read())
+        digest.update(b'\0')
+      except (IOError, OSError):
+        digest.update(b'\1')
+    return digest.hexdigest()
+
+  def Get(self, filename, key):
+    entry = self.files.get(filename)
+    if key is not None and entry and entry[0] == key:
+      return entry[1]
+    return None
+
+  def Put(self, filename, key, result):
+    if key is not None:
+      self.files[filename] = [key, result]
+      self.changed = True
+
+  def Save(self):
+    if not self.changed:
+      return
+    directory = os.path.dirname(self.path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    with open(self.path, 'w') as cache_file:
+      json.dump(self.files, cache_file)
+
+
+def _SettingsFingerprint():
+  """Returns the version of cpplint and the settings that affect its output."""
+  source = __file__
+  if source.endswith('.pyc'):
+    source = source[:-1]
+  with open(source, 'rb') as source_file:
+    fingerprint = hashlib.sha1(source_file.read()).hexdigest()
+  settings = (__VERSION__, fingerprint, _cpplint_state.filters,
+              _cpplint_state.verbose_level, _cpplint_state.counting,
+              _cpplint_state.output_format, _cpplint_state.quiet,
+              _line_length, _root, _repository, sorted(GetAllExtensions()),
+              sorted(GetHeaderExtensions()))
+  return repr(settings).encode('utf-8')
+
+
+def _SameModuleHeaders(filename):
+  """Returns the headers CheckForIncludeWhatYouUse may read for a file.
+
+  These are the headers the file includes that FilesBelongToSameModule
+  considers part of its module, such as foo.h for foo_test.cc or foo-inl.h
+  for foo.cc, under the path CheckForIncludeWhatYouUse opens them at.
+  """
+  abs_filename = re.sub(r'_flymake\.cc$', '.cc', FileInfo(filename).FullName())
+  headers = []
+  try:
+    source = codecs.open(filename, 'r', 'utf8', 'replace')
+  except IOError:
+    return headers
+  with source:
+    for line in source:
+      match = _RE_PATTERN_INCLUDE.search(CleanseComments(line))
+      if match:
+        header = match.group(2)
+        (same_module, common_path) = FilesBelongToSameModule(abs_filename,
+                                                             header)
+        if same_module:
+          headers.append(common_path + header)
+  return headers
+
+
+def _LintInputs(filename):
+  """Returns the files whose contents affect the result of linting a file.
+
+  These are the file itself, the headers CheckHeaderFileIncluded and
+  CheckForIncludeWhatYouUse may look at, and the .cpplint files
+  ProcessConfigOverrides may read.
+  """
+  inputs = [filename]
+  base = os.path.splitext(filename)[0]
+  inputs.extend(base + '.' + ext for ext in sorted(GetHeaderExtensions()))
+  inputs.extend(_SameModuleHeaders(filename))
+  directory = os.path.dirname(os.path.abspath(filename))
+  while True:
+    inputs.append(os.path.join(directory, '.cpplint'))
+    parent = os.path.dirname(directory)
+    if parent == directory:
+      return inputs
+    directory = parent
+
+
+class _RecordedOutput(object):
+  """Records what a file's lint run writes to stdout and stderr, in order."""
+
+  def __init__(self, writes, stream):
+    self.writes = writes
+    self.stream = stream
+
+  def write(self, message):
+    self.writes.append((self.stream, message))
+
+  def flush(self):
+    pass
+
+
+def _SaveLintSettings():
+  """Saves the settings that _LintFile restores before each file."""
+  global _worker_settings
+  _worker_settings = (_line_length, _root, set(_valid_extensions),
+                      set(_hpp_headers))
+
+
+def _InitLintWorker(args):
+  """Sets up a --jobs worker process with the parent's command line options."""
+  ParseArguments(args)
+  _SaveLintSettings()
+
+
+def _LintFile(filename):
+  """Lints one file on its own and records the result.
+
+  Settings that a .cpplint file may change are reset first, so that the
+  result does not depend on which files were linted before.  Error counts
+  are kept apart from _cpplint_state, which is left unchanged.
+
+  Returns:
+    A tuple of the (stream name, message) pairs the file wrote, its error
+    count, its errors by category and its JUnit errors and failures.
+  """
+  global _cpplint_state, _line_length, _root, _valid_extensions, _hpp_headers
+  line_length, root, valid_extensions, hpp_headers = _worker_settings
+  _line_length = line_length
+  _root = root
+  _valid_extensions = set(valid_extensions)
+  _hpp_headers = set(hpp_headers)
+
+  state = _cpplint_state
+  _cpplint_state = copy.deepcopy(state)
+  _cpplint_state.ResetErrorCounts()
+  _cpplint_state._junit_errors = []
+  _cpplint_state._junit_failures = []
+
+  writes = []
+  stdout, stderr = sys.stdout, sys.stderr
+  sys.stdout = _RecordedOutput(writes, 'stdout')
+  sys.stderr = _RecordedOutput(writes, 'stderr')
+  try:
+    ProcessFile(filename, _cpplint_state.verbose_level)
+    return (writes, _cpplint_state.error_count,
+            _cpplint_state.errors_by_category, _cpplint_state._junit_errors,
+            _cpplint_state._junit_failures)
+  finally:
+    sys.stdout, sys.stderr = stdout, stderr
+    _cpplint_state = state
+
+
+def _MergeLintResult(result):
+  """Replays a file's recorded output and adds its counts to _cpplint_state."""
+  writes, error_count, errors_by_category, junit_errors, junit_failures = result
+  for stream, message in writes:
+    if stream == 'stdout':
+      sys.stdout.write(message)
+    else:
+      sys.stderr.write(message)
+  _cpplint_state.error_count += error_count
+  for category, count in iteritems(errors_by_category):
+    _cpplint_state.errors_by_category[category] = (
+        _cpplint_state.errors_by_category.get(category, 0) + count)
+  _cpplint_state._junit_errors.extend(junit_errors)
+  _cpplint_state._junit_failures.extend(junit_failures)
+
+
+def ProcessFiles(filenames, args, jobs, cache):
+  """Lints files in a pool of processes and/or using a result cache.
+
+  Results are merged in the order of |filenames|, so the output is the same
+  as if the files had been processed one after another.
+
+  Args:
+    filenames: The names of the files to lint.
+    args: The command line arguments, used to configure the workers.
+    jobs: The number of worker processes.
+    cache: A LintResultCache, or None.
+  """
+  keys = []
+  stale = []
+  for filename in filenames:
+    key = cache.Key(filename) if cache else None
+    keys.append(key)
+    if not cache or cache.Get(filename, key) is None:
+      stale.append(filename)
+
+  pool = None
+  # Standard input can only be read by this process.
+  if jobs > 1 and len(stale) > 1 and '-' not in stale:
+    pool = multiprocessing.Pool(min(jobs, len(stale)), _InitLintWorker,
+                                (args,))
+    results = pool.imap(_LintFile, stale)
+  else:
+    _SaveLintSettings()
+    results = (_LintFile(filename) for filename in stale)
+
+  try:
+    for filename, key in zip(filenames, keys):
+      result = cache.Get(filename, key) if cache else None
+      if result is None:
+        result = next(results)
+        if cache:
+          cache.Put(filename, key, result)
+      _MergeLintResult(result)
+  finally:
+    if pool:
+      pool.terminate()
+      pool.join()
+    if cache:
+      cache.Save()
+
+
 def main():
   filenames = ParseArguments(sys.argv[1:])
   backup_err = sys.stderr
@@ -6634,8 +7114,18 @@ def main():
     sys.stderr = codecs.StreamReader(sys.stderr, 'replace')
 
     _cpplint_state.ResetErrorCounts()
-    for filename in filenames:
-      ProcessFile(filename, _cpplint_state.verbose_level)
+    profiler = None
+    if _profile_checks:
+      profiler = _CheckProfiler()
+      profiler.Install()
+      for filename in filenames:
+        ProcessFile(filename, _cpplint_state.verbose_level)
+    elif _cache_file or _jobs > 1:
+      cache = LintResultCache(_cache_file) if _cache_file else None
+      ProcessFiles(filenames, sys.argv[1:], _jobs, cache)
+    else:
+      for filename in filenames:
+        ProcessFile(filename, _cpplint_state.verbose_level)
     # If --quiet is passed, suppress printing error count unless there are errors.
     if not _cpplint_state.quiet or _cpplint_state.error_count > 0:
       _cpplint_state.PrintErrorCounts()
@@ -6643,6 +7133,9 @@ def main():
     if _cpplint_state.output_format == 'junit':
       sys.stderr.write(_cpplint_state.FormatJUnitXML())
 
+    if profiler:
+      profiler.Print()
+
   finally:
     sys.stderr = backup_err
 
@@ -136,7 +136,9 @@ def Load(build_files, format, default_variables={},
   result = gyp.input.Load(build_files, default_variables, includes[:],
                           depth, generator_input_info, check, circular_check,
                           duplicate_basename_check,
-                          params['parallel'], params['root_targets'])
+                          params['parallel'], params['root_targets'],
+                          params.get('command_cache'),
+                          params.get('build_file_cache'))
   return [generator] + result
 
 def NameValueListToDict(name_value_list):
@@ -295,6 +297,23 @@ def gyp_main(args):
                     help='configuration for build after project generation')
   parser.add_argument('--check', dest='check', action='store_true',
                     help='check format of gyp files')
+  parser.add_argument('--command-cache', dest='command_cache',
+                    action='store', default=None, metavar='FILE', type='path',
+                    env_name='GYP_COMMAND_CACHE',
+                    help='keep the output of <!(...) commands in FILE and '
+                    'reuse it while their inputs appear unchanged; the inputs '
+                    'are inferred from the command line, so only use this '
+                    'when every command names the files it reads')
+  parser.add_argument('--build-file-cache', dest='build_file_cache',
+                    action='store', default=None, metavar='DIR', type='path',
+                    env_name='GYP_BUILD_FILE_CACHE',
+                    help='keep evaluated build files in DIR and reuse them '
+                    'while the files are unchanged')
+  parser.add_argument('--output-manifest', dest='output_manifest',
+                    action='store', default=None, metavar='FILE', type='path',
+                    env_name='GYP_OUTPUT_MANIFEST',
+                    help='record the sizes and hashes of generated files in '
+                    'FILE, so that unchanged files are not read again')
   parser.add_argument('--config-dir', dest='config_dir', action='store',
                     env_name='GYP_CONFIG_DIR', default=None,
                     help='The location for configuration files like '
@@ -408,6 +427,13 @@ def gyp_main(args):
     if g_o:
       options.generator_output = g_o
 
+  if not options.command_cache and options.use_environment:
+    options.command_cache = os.environ.get('GYP_COMMAND_CACHE')
+  if not options.build_file_cache and options.use_environment:
+    options.build_file_cache = os.environ.get('GYP_BUILD_FILE_CACHE')
+  if not options.output_manifest and options.use_environment:
+    options.output_manifest = os.environ.get('GYP_OUTPUT_MANIFEST')
+
   options.parallel = not options.no_parallel
 
   for mode in options.debug:
@@ -513,6 +539,8 @@ def gyp_main(args):
               'gyp_binary': sys.argv[0],
               'home_dot_gyp': home_dot_gyp,
               'parallel': options.parallel,
+              'command_cache': options.command_cache,
+              'build_file_cache': options.build_file_cache,
               'root_targets': options.root_targets,
               'target_arch': cmdline_default_variables.get('target_arch', '')}
 
@@ -529,7 +557,12 @@ def gyp_main(args):
     # that targets may be built.  Build systems that operate serially or that
     # need to have dependencies defined before dependents reference them should
     # generate targets in the order specified in flat_list.
+    if options.output_manifest:
+      gyp.common.write_manifest = gyp.common.WriteManifest(
+          options.output_manifest)
     generator.GenerateOutput(flat_list, targets, data, params)
+    if gyp.common.write_manifest:
+      gyp.common.write_manifest.Save()
 
     if options.configs:
       valid_configs = targets[flat_list[0]]['configurations'].keys()
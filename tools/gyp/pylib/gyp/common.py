@@ -4,12 +4,18 @@
 
 import collections
 import errno
-import filecmp
+import hashlib
+import json
 import os.path
 import re
 import tempfile
 import sys
 
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
 
 # A minimal memoizing decorator. It'll blow up if the args aren't immutable,
 # among other "problems".
@@ -324,75 +330,150 @@ def AllTargets(target_list, target_dicts, build_file):
   return bftargets + deptargets
 
 
+# The WriteManifest that WriteOnDiff consults and updates, if any.
+write_manifest = None
+
+
+class WriteManifest(object):
+  """Records the files written by WriteOnDiff in a JSON file between runs.
+
+  For every file, the manifest holds its size, modification time and a hash
+  of its contents. As long as the size and modification time of a file are
+  unchanged, WriteOnDiff compares hashes instead of reading the file.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.entries = {}
+    # Entries added by this process. Worker processes send these back to the
+    # main process, which saves them.
+    self.added = {}
+    try:
+      with open(path) as f:
+        self.entries = json.load(f)
+    except (IOError, ValueError):
+      pass
+
+  def Get(self, filename, st):
+    """Returns the recorded hash of filename if it still matches stat st."""
+    entry = self.entries.get(os.path.abspath(filename))
+    if entry and entry[:2] == [st.st_size, st.st_mtime]:
+      return entry[2]
+    return None
+
+  def Put(self, filename, st, digest):
+    entry = [st.st_size, st.st_mtime, digest]
+    filename = os.path.abspath(filename)
+    self.entries[filename] = self.added[filename] = entry
+
+  def Update(self, entries):
+    self.entries.update(entries)
+    self.added.update(entries)
+
+  def Save(self):
+    if not self.added:
+      return
+    EnsureDirExists(self.path)
+    with open(self.path + '.tmp', 'w') as f:
+      json.dump(self.entries, f)
+    if sys.platform == 'win32' and os.path.exists(self.path):
+      os.remove(self.path)
+    os.rename(self.path + '.tmp', self.path)
+    self.added = {}
+
+
+@memoize
+def _GetUmask():
+  # No way to get the umask without setting a new one?  Set a safe one
+  # and then set it back to the old value.
+  umask = os.umask(0o77)
+  os.umask(umask)
+  return umask
+
+
+def _ReplaceFile(filename, contents):
+  """Atomically replaces filename with a new file holding contents."""
+  tmp_fd, tmp_path = tempfile.mkstemp(
+      suffix='.tmp',
+      prefix=os.path.split(filename)[1] + '.gyp.',
+      dir=os.path.split(filename)[0])
+  try:
+    with os.fdopen(tmp_fd, 'wb') as tmp_file:
+      tmp_file.write(contents)
+    # tempfile.mkstemp uses an overly restrictive mode, resulting in a
+    # file that can only be read by the owner, regardless of the umask.
+    # There's no reason to not respect the umask here, which means that
+    # an extra hoop is required to fetch it and reset the new file's mode.
+    os.chmod(tmp_path, 0o666 & ~_GetUmask())
+    if sys.platform == 'win32' and os.path.exists(filename):
+      # NOTE: on windows (but not cygwin) rename will not replace an
+      # existing file, so it must be preceded with a remove. Sadly there
+      # is no way to make the switch atomic.
+      os.remove(filename)
+    os.rename(tmp_path, filename)
+  except Exception:
+    # Don't leave turds behind.
+    os.unlink(tmp_path)
+    raise
+
+
 def WriteOnDiff(filename):
   """Write to a file only if the new contents differ.
 
   Arguments:
     filename: name of the file to potentially write to.
   Returns:
-    A file like object which will write to temporary file and only overwrite
-    the target if it differs (on close).
+    A file like object which collects the new contents in memory and only
+    overwrites the target if it differs (on close).
   """
 
   class Writer(object):
-    """Wrapper around file which only covers the target if it differs."""
+    """Wrapper around an in-memory buffer which only covers the target if it
+    differs."""
     def __init__(self):
-      # Pick temporary file.
-      tmp_fd, self.tmp_path = tempfile.mkstemp(
-          suffix='.tmp',
-          prefix=os.path.split(filename)[1] + '.gyp.',
-          dir=os.path.split(filename)[0])
-      try:
-        self.tmp_file = os.fdopen(tmp_fd, 'wb')
-      except Exception:
-        # Don't leave turds behind.
-        os.unlink(self.tmp_path)
-        raise
+      self.buffer = StringIO()
+      self.name = filename
 
     def __getattr__(self, attrname):
-      # Delegate everything else to self.tmp_file
-      return getattr(self.tmp_file, attrname)
+      # Delegate everything else to self.buffer
+      return getattr(self.buffer, attrname)
+
+    def __enter__(self):
+      return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+      if exc_type is None:
+        self.close()
 
     def close(self):
+      contents = self.buffer.getvalue()
+      self.buffer.close()
+      if not isinstance(contents, bytes):
+        contents = contents.encode('utf-8')
+      digest = hashlib.sha1(contents).hexdigest()
+
+      # Determine if different.
+      same = False
       try:
-        # Close tmp file.
-        self.tmp_file.close()
-        # Determine if different.
-        same = False
-        try:
-          same = filecmp.cmp(self.tmp_path, filename, False)
-        except OSError as e:
-          if e.errno != errno.ENOENT:
-            raise
-
-        if same:
-          # The new file is identical to the old one, just get rid of the new
-          # one.
-          os.unlink(self.tmp_path)
-        else:
-          # The new file is different from the old one, or there is no old one.
-          # Rename the new file to the permanent name.
-          #
-          # tempfile.mkstemp uses an overly restrictive mode, resulting in a
-          # file that can only be read by the owner, regardless of the umask.
-          # There's no reason to not respect the umask here, which means that
-          # an extra hoop is required to fetch it and reset the new file's mode.
-          #
-          # No way to get the umask without setting a new one?  Set a safe one
-          # and then set it back to the old value.
-          umask = os.umask(0o77)
-          os.umask(umask)
-          os.chmod(self.tmp_path, 0o666 & ~umask)
-          if sys.platform == 'win32' and os.path.exists(filename):
-            # NOTE: on windows (but not cygwin) rename will not replace an
-            # existing file, so it must be preceded with a remove. Sadly there
-            # is no way to make the switch atomic.
-            os.remove(filename)
-          os.rename(self.tmp_path, filename)
-      except Exception:
-        # Don't leave turds behind.
-        os.unlink(self.tmp_path)
-        raise
+        st = os.stat(filename)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+      else:
+        if st.st_size == len(contents):
+          recorded = write_manifest and write_manifest.Get(filename, st)
+          if recorded:
+            same = recorded == digest
+          else:
+            with open(filename, 'rb') as f:
+              same = f.read() == contents
+
+      if not same:
+        # The new file is different from the old one, or there is no old one.
+        _ReplaceFile(filename, contents)
+        st = os.stat(filename)
+      if write_manifest:
+        write_manifest.Put(filename, st, digest)
 
   return Writer()
 
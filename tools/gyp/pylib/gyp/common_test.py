@@ -7,6 +7,9 @@
 """Unit tests for the common.py file."""
 
 import gyp.common
+import os
+import shutil
+import tempfile
 import unittest
 import sys
 
@@ -68,5 +71,76 @@ class TestGetFlavor(unittest.TestCase):
     self.assertFlavor('foobar', 'linux2' , {'flavor': 'foobar'})
 
 
+class TestWriteOnDiff(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'out.mk')
+    self.manifest_path = os.path.join(self.dir, 'manifest.json')
+
+  def tearDown(self):
+    gyp.common.write_manifest = None
+    shutil.rmtree(self.dir)
+
+  def _write(self, contents):
+    # Each call acts as a new run of gyp that reads the manifest.
+    gyp.common.write_manifest = gyp.common.WriteManifest(self.manifest_path)
+    with gyp.common.WriteOnDiff(self.path) as f:
+      f.write(contents)
+    gyp.common.write_manifest.Save()
+    with open(self.path) as f:
+      return f.read()
+
+  def _set_mtime(self, mtime):
+    os.utime(self.path, (mtime, mtime))
+
+  def test_writes_new_file(self):
+    self.assertEqual('a\n', self._write('a\n'))
+    self.assertEqual(['manifest.json', 'out.mk'], sorted(os.listdir(self.dir)))
+
+  def test_keeps_unchanged_file(self):
+    self._write('a\n')
+    self._set_mtime(1000000000)
+    self._write('a\n')
+    self.assertEqual(1000000000, os.stat(self.path).st_mtime)
+
+  def test_replaces_changed_file(self):
+    self._write('a\n')
+    self._set_mtime(1000000000)
+    self.assertEqual('b\n', self._write('b\n'))
+    self.assertEqual('bb\n', self._write('bb\n'))
+
+  def test_without_manifest(self):
+    gyp.common.write_manifest = None
+    with open(self.path, 'w') as f:
+      f.write('a\n')
+    self._set_mtime(1000000000)
+    f = gyp.common.WriteOnDiff(self.path)
+    f.write('a\n')
+    f.close()
+    self.assertEqual(1000000000, os.stat(self.path).st_mtime)
+    f = gyp.common.WriteOnDiff(self.path)
+    f.write('b\n')
+    f.close()
+    with open(self.path) as f:
+      self.assertEqual('b\n', f.read())
+
+  def test_behaves_like_a_file(self):
+    f = gyp.common.WriteOnDiff(self.path)
+    f.writelines(['a\n', 'b\n'])
+    f.flush()
+    self.assertEqual(4, f.tell())
+    self.assertEqual(self.path, f.name)
+    f.close()
+    with open(self.path) as f:
+      self.assertEqual('a\nb\n', f.read())
+
+  def test_file_changed_behind_manifest(self):
+    self._write('a\n')
+    with open(self.path, 'w') as f:
+      f.write('c\n')
+    self._set_mtime(1000000000)
+    self.assertEqual('a\n', self._write('a\n'))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -1102,7 +1102,7 @@ def GenerateOutputForConfig(target_list, target_dicts, data,
   output_file = os.path.join(toplevel_build, 'CMakeLists.txt')
   gyp.common.EnsureDirExists(output_file)
 
-  output = open(output_file, 'w')
+  output = gyp.common.WriteOnDiff(output_file)
   output.write('cmake_minimum_required(VERSION 2.8.8 FATAL_ERROR)\n')
   output.write('cmake_policy(VERSION 2.8.8)\n')
 
@@ -1223,7 +1223,12 @@ def CallGenerateOutputForConfig(arglist):
   signal.signal(signal.SIGINT, signal.SIG_IGN)
 
   target_list, target_dicts, data, params, config_name = arglist
+  manifest = gyp.common.write_manifest
+  if manifest:
+    manifest.added = {}
   GenerateOutputForConfig(target_list, target_dicts, data, params, config_name)
+  # Send the files this process recorded back to the parent.
+  return manifest and manifest.added
 
 
 def GenerateOutput(target_list, target_dicts, data, params):
@@ -1240,7 +1245,9 @@ def GenerateOutput(target_list, target_dicts, data, params):
         for config_name in config_names:
           arglists.append((target_list, target_dicts, data,
                            params, config_name))
-          pool.map(CallGenerateOutputForConfig, arglists)
+          for entries in pool.map(CallGenerateOutputForConfig, arglists):
+            if entries:
+              gyp.common.write_manifest.Update(entries)
       except KeyboardInterrupt as e:
         pool.terminate()
         raise e
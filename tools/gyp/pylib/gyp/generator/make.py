@@ -23,8 +23,10 @@
 
 from __future__ import print_function
 
+import multiprocessing
 import os
 import re
+import signal
 import sys
 import subprocess
 import gyp
@@ -705,36 +707,22 @@ $(obj).$(TOOLSET)/$(TARGET)/%%.o: $(obj)/%%%s FORCE_DO_CMD
 """ % (ext, COMPILABLE_EXTENSIONS[ext]))})
 
 
-  def Write(self, qualified_target, base_path, output_filename, spec, configs,
-            part_of_all):
+  def Write(self, output_filename, spec, configs, part_of_all):
     """The main entry point: writes a .mk file for a single target.
 
+    ComputeTargetOutputs must have been called for the target first.
+
     Arguments:
-      qualified_target: target we're generating
-      base_path: path relative to source root we're building in, used to resolve
-                 target-relative paths
       output_filename: output .mk file name to write
       spec, configs: gyp info
       part_of_all: flag indicating this target is part of 'all'
     """
     gyp.common.EnsureDirExists(output_filename)
 
-    self.fp = open(output_filename, 'w')
+    self.fp = gyp.common.WriteOnDiff(output_filename)
 
     self.fp.write(header)
 
-    self.qualified_target = qualified_target
-    self.path = base_path
-    self.target = spec['target_name']
-    self.type = spec['type']
-    self.toolset = spec['toolset']
-
-    self.is_mac_bundle = gyp.xcode_emulation.IsMacBundle(self.flavor, spec)
-    if self.flavor == 'mac':
-      self.xcode_settings = gyp.xcode_emulation.XcodeSettings(spec)
-    else:
-      self.xcode_settings = None
-
     deps, link_deps = self.ComputeDeps(spec)
 
     # Some of the generation below can add extra output, sources, or
@@ -746,24 +734,6 @@ $(obj).$(TOOLSET)/$(TARGET)/%%.o: $(obj)/%%%s FORCE_DO_CMD
     extra_mac_bundle_resources = []
     mac_bundle_deps = []
 
-    if self.is_mac_bundle:
-      self.output = self.ComputeMacBundleOutput(spec)
-      self.output_binary = self.ComputeMacBundleBinaryOutput(spec)
-    else:
-      self.output = self.output_binary = self.ComputeOutput(spec)
-
-    self.is_standalone_static_library = bool(
-        spec.get('standalone_static_library', 0))
-    self._INSTALLABLE_TARGETS = ('executable', 'loadable_module',
-                                 'shared_library')
-    if (self.is_standalone_static_library or
-        self.type in self._INSTALLABLE_TARGETS):
-      self.alias = os.path.basename(self.output)
-      install_path = self._InstallableTargetInstallPath()
-    else:
-      self.alias = self.output
-      install_path = self.output
-
     self.WriteLn("TOOLSET := " + self.toolset)
     self.WriteLn("TARGET := " + self.target)
 
@@ -823,13 +793,6 @@ $(obj).$(TOOLSET)/$(TARGET)/%%.o: $(obj)/%%%s FORCE_DO_CMD
     self.WriteTarget(spec, configs, deps, extra_link_deps + link_deps,
                      mac_bundle_deps, extra_outputs, part_of_all)
 
-    # Update global list of target outputs, used in dependency tracking.
-    target_outputs[qualified_target] = install_path
-
-    # Update global list of link dependencies.
-    if self.type in ('static_library', 'shared_library'):
-      target_link_deps[qualified_target] = self.output_binary
-
     # Currently any versions have the same effect, but in future the behavior
     # could be different.
     if self.generator_flags.get('android_ndk_version', None):
@@ -838,6 +801,56 @@ $(obj).$(TOOLSET)/$(TARGET)/%%.o: $(obj)/%%%s FORCE_DO_CMD
     self.fp.close()
 
 
+  def ComputeTargetOutputs(self, qualified_target, base_path, spec):
+    """Sets up the writer for a target and records the target's outputs.
+
+    This does not write anything, so GenerateOutput can call it for every
+    target before any .mk file is written, and then hand the writer to Write.
+
+    Arguments:
+      qualified_target: target we're generating
+      base_path: path relative to source root we're building in, used to resolve
+                 target-relative paths
+      spec: gyp info
+    """
+    self.qualified_target = qualified_target
+    self.path = base_path
+    self.target = spec['target_name']
+    self.type = spec['type']
+    self.toolset = spec['toolset']
+
+    self.is_mac_bundle = gyp.xcode_emulation.IsMacBundle(self.flavor, spec)
+    if self.flavor == 'mac':
+      self.xcode_settings = gyp.xcode_emulation.XcodeSettings(spec)
+    else:
+      self.xcode_settings = None
+
+    if self.is_mac_bundle:
+      self.output = self.ComputeMacBundleOutput(spec)
+      self.output_binary = self.ComputeMacBundleBinaryOutput(spec)
+    else:
+      self.output = self.output_binary = self.ComputeOutput(spec)
+
+    self.is_standalone_static_library = bool(
+        spec.get('standalone_static_library', 0))
+    self._INSTALLABLE_TARGETS = ('executable', 'loadable_module',
+                                 'shared_library')
+    if (self.is_standalone_static_library or
+        self.type in self._INSTALLABLE_TARGETS):
+      self.alias = os.path.basename(self.output)
+      install_path = self._InstallableTargetInstallPath()
+    else:
+      self.alias = self.output
+      install_path = self.output
+
+    # Update global list of target outputs, used in dependency tracking.
+    target_outputs[qualified_target] = install_path
+
+    # Update global list of link dependencies.
+    if self.type in ('static_library', 'shared_library'):
+      target_link_deps[qualified_target] = self.output_binary
+
+
   def WriteSubMake(self, output_filename, makefile_path, targets, build_dir):
     """Write a "sub-project" Makefile.
 
@@ -851,7 +864,7 @@ $(obj).$(TOOLSET)/$(TARGET)/%%.o: $(obj)/%%%s FORCE_DO_CMD
       build_dir: build output directory, relative to the sub-project
     """
     gyp.common.EnsureDirExists(output_filename)
-    self.fp = open(output_filename, 'w')
+    self.fp = gyp.common.WriteOnDiff(output_filename)
     self.fp.write(header)
     # For consistency with other builders, put sub-project build output in the
     # sub-project dir (see test/subdirectory/gyptest-subdir-all.py).
@@ -1938,6 +1951,33 @@ $(obj).$(TOOLSET)/$(TARGET)/%%.o: $(obj)/%%%s FORCE_DO_CMD
     return '$(builddir)/' + self.alias
 
 
+def WriteMakefile(writer, output_file, spec, configs, part_of_all):
+  writer.Write(output_file, spec, configs, part_of_all=part_of_all)
+
+
+def InitMakefileWriter(outputs, link_deps, compilable_extensions,
+                       write_manifest):
+  # Ignore the interrupt signal so that the parent process catches it and
+  # kills all multiprocessing children.
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  # Processes that were not forked start without the state that
+  # GenerateOutput and CalculateVariables have set up.
+  target_outputs.update(outputs)
+  target_link_deps.update(link_deps)
+  COMPILABLE_EXTENSIONS.update(compilable_extensions)
+  gyp.common.write_manifest = write_manifest
+
+
+def CallWriteMakefile(arglist):
+  manifest = gyp.common.write_manifest
+  if manifest:
+    manifest.added = {}
+  WriteMakefile(*arglist)
+  # Send the files this process recorded back to the parent.
+  return manifest and manifest.added
+
+
 def WriteAutoRegenerationRule(params, root_makefile, makefile_name,
                               build_files):
   """Write the target to regenerate the Makefile."""
@@ -2115,6 +2155,8 @@ def GenerateOutput(target_list, target_dicts, data, params):
   header_params['make_global_settings'] = make_global_settings
 
   gyp.common.EnsureDirExists(makefile_path)
+  # The root Makefile is always rewritten, not through WriteOnDiff: its
+  # regeneration rule relies on its timestamp moving past the build files'.
   root_makefile = open(makefile_path, 'w')
   root_makefile.write(SHARED_HEADER % header_params)
   # Currently any versions have the same effect, but in future the behavior
@@ -2140,6 +2182,7 @@ def GenerateOutput(target_list, target_dicts, data, params):
 
   build_files = set()
   include_list = set()
+  arglists = []
   for qualified_target in target_list:
     build_file, target, toolset = gyp.common.ParseQualifiedTarget(
         qualified_target)
@@ -2176,9 +2219,13 @@ def GenerateOutput(target_list, target_dicts, data, params):
     if flavor == 'mac':
       gyp.xcode_emulation.MergeGlobalXcodeSettingsToSpec(data[build_file], spec)
 
+    # Record the outputs of every target first, so that the .mk files, which
+    # only need the outputs of their dependencies, can be written in any
+    # order.
     writer = MakefileWriter(generator_flags, flavor)
-    writer.Write(qualified_target, base_path, output_file, spec, configs,
-                 part_of_all=qualified_target in needed_targets)
+    writer.ComputeTargetOutputs(qualified_target, base_path, spec)
+    arglists.append((writer, output_file, spec, configs,
+                     qualified_target in needed_targets))
 
     # Our root_makefile lives at the source root.  Compute the relative path
     # from there to the output_file for including.
@@ -2186,6 +2233,27 @@ def GenerateOutput(target_list, target_dicts, data, params):
                                               os.path.dirname(makefile_path))
     include_list.add(mkfile_rel_path)
 
+  # Writing the .mk files in a pool is opt-in through its own generator flag,
+  # separate from --parallel, which only covers loading the build files.
+  if (generator_flags.get('parallel_makefiles', False) and
+      len(arglists) > 1 and multiprocessing.cpu_count() > 1):
+    try:
+      pool = multiprocessing.Pool(
+          initializer=InitMakefileWriter,
+          initargs=(target_outputs, target_link_deps, COMPILABLE_EXTENSIONS,
+                    gyp.common.write_manifest))
+      for entries in pool.map(CallWriteMakefile, arglists):
+        if entries:
+          gyp.common.write_manifest.Update(entries)
+      pool.close()
+      pool.join()
+    except KeyboardInterrupt as e:
+      pool.terminate()
+      raise e
+  else:
+    for arglist in arglists:
+      WriteMakefile(*arglist)
+
   # Write out per-gyp (sub-project) Makefiles.
   depth_rel_path = gyp.common.RelativePath(options.depth, os.getcwd())
   for build_file in build_files:
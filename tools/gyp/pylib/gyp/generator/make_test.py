@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+""" Unit tests for the make.py file. """
+
+import gyp
+import gyp.generator.make
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+
+BUILD_FILE = """\
+{
+  'targets': [
+    {
+      'target_name': 'base',
+      'type': 'static_library',
+      'sources': ['base.cc'],
+    },
+    {
+      'target_name': 'shared',
+      'type': 'shared_library',
+      'dependencies': ['base'],
+      'sources': ['shared.cc'],
+    },
+    {
+      'target_name': 'generate',
+      'type': 'none',
+      'actions': [{
+        'action_name': 'generate',
+        'inputs': ['input.txt'],
+        'outputs': ['<(INTERMEDIATE_DIR)/generated.cc'],
+        'action': ['cp', '<@(_inputs)', '<@(_outputs)'],
+      }],
+    },
+    {
+      'target_name': 'program',
+      'type': 'executable',
+      'dependencies': ['base', 'shared', 'generate', 'sub/sub.gyp:sub'],
+      'sources': ['main.cc'],
+    },
+  ],
+}
+"""
+
+SUB_BUILD_FILE = """\
+{
+  'targets': [
+    {
+      'target_name': 'sub',
+      'type': 'static_library',
+      'sources': ['sub.cc'],
+    },
+  ],
+}
+"""
+
+
+class TestParallelMakefiles(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.cwd = os.getcwd()
+    os.chdir(self.dir)
+    os.mkdir('sub')
+    with open('test.gyp', 'w') as f:
+      f.write(BUILD_FILE)
+    with open(os.path.join('sub', 'sub.gyp'), 'w') as f:
+      f.write(SUB_BUILD_FILE)
+    # The pool only starts with more than one CPU.
+    self.cpu_count = multiprocessing.cpu_count
+    multiprocessing.cpu_count = lambda: 4
+
+  def tearDown(self):
+    multiprocessing.cpu_count = self.cpu_count
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
+
+  def _generate(self, *flags):
+    """Generates the Makefiles and returns the contents of every file."""
+    args = ['-f', 'make', '--depth=.', '--generator-output=out',
+            '-G', 'auto_regeneration=0'] + list(flags) + ['test.gyp']
+    self.assertEqual(0, gyp.main(args))
+    files = {}
+    for root, dirs, names in os.walk('out'):
+      for name in names:
+        path = os.path.join(root, name)
+        with open(path) as f:
+          files[path] = f.read()
+    shutil.rmtree('out')
+    return files
+
+  def test_same_output_as_serial(self):
+    serial = self._generate()
+    parallel = self._generate('-G', 'parallel_makefiles=1')
+    self.assertIn(os.path.join('out', 'program.target.mk'), serial)
+    self.assertIn(os.path.join('out', 'sub', 'sub.Makefile'), serial)
+    self.assertEqual(sorted(serial), sorted(parallel))
+    for path in serial:
+      self.assertEqual(serial[path], parallel[path], path)
+
+
+if __name__ == '__main__':
+  unittest.main()
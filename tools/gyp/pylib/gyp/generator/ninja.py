@@ -408,8 +408,7 @@ class NinjaWriter(object):
         self.arch_subninjas = dict(
             (arch, ninja_syntax.Writer(
                 OpenOutput(os.path.join(self.toplevel_build,
-                                        self._SubninjaNameForArch(arch)),
-                           'w')))
+                                        self._SubninjaNameForArch(arch)))))
             for arch in self.archs)
 
     # Compute predepends for all rules.
@@ -510,6 +509,11 @@ class NinjaWriter(object):
     if self.is_mac_bundle:
       output = self.WriteMacBundle(spec, mac_bundle_depends, is_empty_bundle)
 
+    # The per-arch subninjas are complete; write them out.
+    if self.flavor == 'mac' and len(self.archs) > 1:
+      for arch_subninja in self.arch_subninjas.values():
+        arch_subninja.output.close()
+
     if not output:
       return None
 
@@ -1730,10 +1734,12 @@ def CalculateGeneratorInputInfo(params):
   }
 
 
-def OpenOutput(path, mode='w'):
-  """Open |path| for writing, creating directories if necessary."""
+def OpenOutput(path):
+  """Open |path| for writing, creating directories if necessary.
+
+  The file is written in binary mode, and only if its contents change."""
   gyp.common.EnsureDirExists(path)
-  return open(path, mode)
+  return gyp.common.WriteOnDiff(path)
 
 
 def CommandWithWrapper(cmd, wrappers, prog):
@@ -2454,7 +2460,12 @@ def CallGenerateOutputForConfig(arglist):
   signal.signal(signal.SIGINT, signal.SIG_IGN)
 
   (target_list, target_dicts, data, params, config_name) = arglist
+  manifest = gyp.common.write_manifest
+  if manifest:
+    manifest.added = {}
   GenerateOutputForConfig(target_list, target_dicts, data, params, config_name)
+  # Send the files this process recorded back to the parent.
+  return manifest and manifest.added
 
 
 def GenerateOutput(target_list, target_dicts, data, params):
@@ -2480,7 +2491,9 @@ def GenerateOutput(target_list, target_dicts, data, params):
         for config_name in config_names:
           arglists.append(
               (target_list, target_dicts, data, params, config_name))
-        pool.map(CallGenerateOutputForConfig, arglists)
+        for entries in pool.map(CallGenerateOutputForConfig, arglists):
+          if entries:
+            gyp.common.write_manifest.Update(entries)
       except KeyboardInterrupt as e:
         pool.terminate()
         raise e
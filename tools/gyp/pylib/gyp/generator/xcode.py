@@ -4,7 +4,6 @@
 
 from __future__ import print_function
 
-import filecmp
 import gyp.common
 import gyp.xcodeproj_file
 import gyp.xcode_ninja
@@ -15,7 +14,6 @@ import posixpath
 import re
 import shutil
 import subprocess
-import tempfile
 
 
 # Project files generated by this module will use _intermediate_var as a
@@ -440,51 +438,16 @@ sys.exit(subprocess.call(sys.argv[1:]))" """
     # being renamed over an open project file as a change and so it remains
     # able to present the "project file changed" sheet under this system.
     # Writing to a temporary file first also avoids the possible problem of
-    # Xcode rereading an incomplete project file.
-    (output_fd, new_pbxproj_path) = \
-        tempfile.mkstemp(suffix='.tmp', prefix='project.pbxproj.gyp.',
-                         dir=self.path)
-
+    # Xcode rereading an incomplete project file.  gyp.common.WriteOnDiff
+    # takes care of all of this.
     try:
-      output_file = os.fdopen(output_fd, 'wb')
-
+      output_file = gyp.common.WriteOnDiff(
+          os.path.join(self.path, 'project.pbxproj'))
       self.project_file.Print(output_file)
       output_file.close()
-
-      pbxproj_path = os.path.join(self.path, 'project.pbxproj')
-
-      same = False
-      try:
-        same = filecmp.cmp(pbxproj_path, new_pbxproj_path, False)
-      except OSError as e:
-        if e.errno != errno.ENOENT:
-          raise
-
-      if same:
-        # The new file is identical to the old one, just get rid of the new
-        # one.
-        os.unlink(new_pbxproj_path)
-      else:
-        # The new file is different from the old one, or there is no old one.
-        # Rename the new file to the permanent name.
-        #
-        # tempfile.mkstemp uses an overly restrictive mode, resulting in a
-        # file that can only be read by the owner, regardless of the umask.
-        # There's no reason to not respect the umask here, which means that
-        # an extra hoop is required to fetch it and reset the new file's mode.
-        #
-        # No way to get the umask without setting a new one?  Set a safe one
-        # and then set it back to the old value.
-        umask = os.umask(0o77)
-        os.umask(umask)
-
-        os.chmod(new_pbxproj_path, 0o666 & ~umask)
-        os.rename(new_pbxproj_path, pbxproj_path)
-
     except Exception:
-      # Don't leave turds behind.  In fact, if this code was responsible for
-      # creating the xcodeproj directory, get rid of that too.
-      os.unlink(new_pbxproj_path)
+      # If this code was responsible for creating the xcodeproj directory, get
+      # rid of that too.
       if self.created_dir:
         shutil.rmtree(self.path, True)
       raise
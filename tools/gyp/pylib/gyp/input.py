@@ -12,6 +12,9 @@ from compiler.ast import Stmt
 import compiler
 import gyp.common
 import gyp.simple_copy
+import hashlib
+import json
+import marshal
 import multiprocessing
 import optparse
 import os.path
@@ -225,29 +228,125 @@ def CheckNode(node, keypath):
          "': " + repr(node))
 
 
+# The BuildFileCache that keeps evaluated build files between runs, if any.
+build_file_cache = None
+
+# The names of the entries in a BuildFileCache, which are SHA-1 hex digests.
+cache_entry_name_re = re.compile(r'^[0-9a-f]{40}$')
+
+
+class BuildFileCache(object):
+  """Keeps the evaluated contents of build files in a directory between runs.
+
+  Each evaluated file is marshalled into a file named after a hash of its
+  contents, so an unchanged build file is neither evaluated nor, as long as
+  its size and modification time are unchanged, even read again. An index
+  maps the path of each build file to its size, modification time and hash.
+  The cache is only used when asked for with --build-file-cache.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.index_path = os.path.join(directory, 'index.json')
+    self.index = {}
+    # Index entries added by this process. Workers send these back to the
+    # main process, which saves them.
+    self.added = {}
+    try:
+      with open(self.index_path) as f:
+        self.index = json.load(f)
+    except (IOError, ValueError):
+      pass
+
+  def Key(self, path, check):
+    """Returns the hash of a build file, and its contents if they had to be
+    read."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = [st.st_mtime, st.st_size, bool(check)]
+    entry = self.index.get(path)
+    if entry and entry[:3] == stamp:
+      return str(entry[3]), None
+    contents = open(path).read()
+    # marshal's format depends on the version of Python.
+    digest = hashlib.sha1('%s\0%s\0' % (sys.version, bool(check)))
+    digest.update(contents)
+    key = digest.hexdigest()
+    self.index[path] = self.added[path] = stamp + [key]
+    return key, contents
+
+  def Get(self, key):
+    try:
+      with open(os.path.join(self.directory, key), 'rb') as f:
+        return marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+      return None
+
+  def Put(self, key, build_file_data):
+    path = os.path.join(self.directory, key)
+    gyp.common.EnsureDirExists(path)
+    with open(path + '.tmp', 'wb') as f:
+      marshal.dump(build_file_data, f)
+    if os.path.exists(path):
+      os.remove(path)
+    os.rename(path + '.tmp', path)
+
+  def Update(self, entries):
+    self.index.update(entries)
+    self.added.update(entries)
+
+  def Save(self):
+    """Saves the index and removes the entries it no longer refers to."""
+    if not self.added:
+      return
+    gyp.common.EnsureDirExists(self.index_path)
+    with open(self.index_path + '.tmp', 'w') as f:
+      json.dump(self.index, f)
+    if os.path.exists(self.index_path):
+      os.remove(self.index_path)
+    os.rename(self.index_path + '.tmp', self.index_path)
+    self.added = {}
+    keys = set(entry[3] for entry in self.index.itervalues())
+    for name in os.listdir(self.directory):
+      path = os.path.join(self.directory, name)
+      # Only remove entries written by Put, whatever else is in the directory.
+      if (name not in keys and cache_entry_name_re.match(name) and
+          os.path.isfile(path)):
+        os.remove(path)
+
+
 def LoadOneBuildFile(build_file_path, data, aux_data, includes,
                      is_target, check):
   if build_file_path in data:
     return data[build_file_path]
 
-  if os.path.exists(build_file_path):
-    build_file_contents = open(build_file_path).read()
-  else:
+  if not os.path.exists(build_file_path):
     raise GypError("%s not found (cwd: %s)" % (build_file_path, os.getcwd()))
 
   build_file_data = None
-  try:
-    if check:
-      build_file_data = CheckedEval(build_file_contents)
-    else:
-      build_file_data = eval(build_file_contents, {'__builtins__': None},
-                             None)
-  except SyntaxError, e:
-    e.filename = build_file_path
-    raise
-  except Exception, e:
-    gyp.common.ExceptionAppend(e, 'while reading ' + build_file_path)
-    raise
+  build_file_contents = None
+  if build_file_cache:
+    cache_key, build_file_contents = build_file_cache.Key(build_file_path,
+                                                          check)
+    build_file_data = build_file_cache.Get(cache_key)
+
+  if build_file_data is None:
+    if build_file_contents is None:
+      build_file_contents = open(build_file_path).read()
+    try:
+      if check:
+        build_file_data = CheckedEval(build_file_contents)
+      else:
+        build_file_data = eval(build_file_contents, {'__builtins__': None},
+                               None)
+    except SyntaxError, e:
+      e.filename = build_file_path
+      raise
+    except Exception, e:
+      gyp.common.ExceptionAppend(e, 'while reading ' + build_file_path)
+      raise
+    if build_file_cache and type(build_file_data) is dict:
+      build_file_cache.Put(cache_key, build_file_data)
 
   if type(build_file_data) is not dict:
     raise GypError("%s does not evaluate to a dictionary." % build_file_path)
@@ -429,6 +528,7 @@ def LoadTargetBuildFile(build_file_path, data, aux_data, variables, includes,
                      build_file_path)
 
     index = 0
+    last_index = len(build_file_data['targets']) - 1
     while index < len(build_file_data['targets']):
       # This procedure needs to give the impression that target_defaults is
       # used as defaults, and the individual targets inherit from that.
@@ -436,10 +536,14 @@ def LoadTargetBuildFile(build_file_path, data, aux_data, variables, includes,
       # a deep copy of the defaults for each target, merge the target dict
       # as found in the input file into that copy, and then hook up the
       # copy with the target-specific data merged into it as the replacement
-      # target dict.
+      # target dict.  target_defaults is dropped afterwards, so the last
+      # target can take it over instead of a copy.
       old_target_dict = build_file_data['targets'][index]
-      new_target_dict = gyp.simple_copy.deepcopy(
-        build_file_data['target_defaults'])
+      if index == last_index:
+        new_target_dict = build_file_data['target_defaults']
+      else:
+        new_target_dict = gyp.simple_copy.deepcopy(
+          build_file_data['target_defaults'])
       MergeDicts(new_target_dict, old_target_dict,
                  build_file_path, build_file_path)
       build_file_data['targets'][index] = new_target_dict
@@ -490,6 +594,10 @@ def CallLoadTargetBuildFile(global_flags,
     # Apply globals so that the worker process behaves the same.
     for key, value in global_flags.iteritems():
       globals()[key] = value
+    if command_cache:
+      command_cache.added = {}
+    if build_file_cache:
+      build_file_cache.added = {}
 
     SetGeneratorGlobals(generator_input_info)
     result = LoadTargetBuildFile(build_file_path, per_process_data,
@@ -509,7 +617,9 @@ def CallLoadTargetBuildFile(global_flags,
     # It's handled in LoadTargetBuildFileCallback.
     return (build_file_path,
             build_file_data,
-            dependencies)
+            dependencies,
+            command_cache and command_cache.added,
+            build_file_cache and build_file_cache.added)
   except GypError, e:
     sys.stderr.write("gyp: %s\n" % e)
     return None
@@ -559,7 +669,12 @@ class ParallelState(object):
       self.condition.notify()
       self.condition.release()
       return
-    (build_file_path0, build_file_data0, dependencies0) = result
+    (build_file_path0, build_file_data0, dependencies0, commands0,
+     build_files0) = result
+    if commands0:
+      command_cache.Update(commands0)
+    if build_files0:
+      build_file_cache.Update(build_files0)
     self.data[build_file_path0] = build_file_data0
     self.data['target_build_files'].add(build_file_path0)
     for new_dependency in dependencies0:
@@ -596,7 +711,9 @@ def LoadTargetBuildFilesParallel(build_files, data, variables, includes, depth,
       global_flags = {
         'path_sections': globals()['path_sections'],
         'non_configuration_keys': globals()['non_configuration_keys'],
-        'multiple_toolsets': globals()['multiple_toolsets']}
+        'multiple_toolsets': globals()['multiple_toolsets'],
+        'command_cache': globals()['command_cache'],
+        'build_file_cache': globals()['build_file_cache']}
 
       if not parallel_state.pool:
         parallel_state.pool = multiprocessing.Pool(multiprocessing.cpu_count())
@@ -692,6 +809,111 @@ latelate_variable_re = re.compile(
 # more then once.
 cached_command_results = {}
 
+# The CommandCache that keeps command results between runs, if any.
+command_cache = None
+
+# Environment variables that commands commonly depend on without naming them,
+# such as the search path for the programs they run.
+COMMAND_CACHE_ENVIRONMENT = ['PATH', 'PKG_CONFIG_LIBDIR', 'PKG_CONFIG_PATH',
+                             'PYTHONPATH']
+
+environment_reference_re = re.compile(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)')
+
+
+class CommandCache(object):
+  """Keeps the output of <!(...) commands in a file between runs of gyp.
+
+  Entries are keyed by the command and the directory it runs in, and are only
+  reused while the inputs of the command are unchanged. The inputs are the
+  contents of the files named by its arguments, which covers the script it
+  runs, and the environment variables it refers to as well as those in
+  COMMAND_CACHE_ENVIRONMENT.
+
+  The inputs are inferred from the command line rather than declared, so a
+  command that reads files or environment variables it does not name will
+  return stale output. The cache is therefore only used when asked for with
+  --command-cache.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.entries = {}
+    # Entries added by this process. Workers send these back to the main
+    # process, which saves them.
+    self.added = {}
+    try:
+      with open(path) as f:
+        self.entries = json.load(f)
+    except (IOError, ValueError):
+      pass
+
+  @staticmethod
+  def Key(command, cwd):
+    return json.dumps([command, os.path.abspath(cwd or os.curdir)])
+
+  @staticmethod
+  def Inputs(command, cwd, command_string=None):
+    """Returns a fingerprint of the inputs of a command."""
+    if type(command) is list:
+      tokens = command
+      text = ' '.join(command)
+    else:
+      text = command
+      try:
+        tokens = shlex.split(command)
+      except ValueError:
+        tokens = command.split()
+    if command_string == 'pymod_do_main' and tokens:
+      tokens = [tokens[0] + '.py'] + tokens[1:]
+    files = []
+    for token in tokens:
+      path = os.path.join(cwd or os.curdir, token)
+      try:
+        with open(path, 'rb') as f:
+          files.append([token, hashlib.sha1(f.read()).hexdigest()])
+      except (IOError, TypeError):
+        pass
+    names = set(COMMAND_CACHE_ENVIRONMENT)
+    names.update(environment_reference_re.findall(text))
+    environment = [[name, os.environ.get(name)] for name in sorted(names)]
+    return [files, environment]
+
+  def Get(self, key, inputs):
+    """Returns the stored output of a command, or None if its inputs have
+    changed."""
+    entry = self.entries.get(key)
+    if not entry or entry['inputs'] != inputs:
+      return None
+    output = entry['output']
+    if type(output) is not str:
+      output = output.encode('utf-8')
+    return output
+
+  def Put(self, key, inputs, output):
+    entry = {'inputs': inputs, 'output': output}
+    try:
+      json.dumps(entry)
+    except UnicodeDecodeError:
+      # Output that is not UTF-8 cannot be stored.
+      return
+    self.entries[key] = entry
+    self.added[key] = entry
+
+  def Update(self, entries):
+    self.entries.update(entries)
+    self.added.update(entries)
+
+  def Save(self):
+    if not self.added:
+      return
+    gyp.common.EnsureDirExists(self.path)
+    with open(self.path + '.tmp', 'w') as f:
+      json.dump(self.entries, f)
+    if os.path.exists(self.path):
+      os.remove(self.path)
+    os.rename(self.path + '.tmp', self.path)
+    self.added = {}
+
 
 def FixupPlatformCommand(cmd):
   if sys.platform == 'win32':
@@ -785,7 +1007,7 @@ def ExpandVariables(input, phase, variables, build_file):
     # contexts. However, since filtration has no chance to run on <|(),
     # this seems like the only obvious way to give them access to filters.
     if file_list:
-      processed_variables = gyp.simple_copy.deepcopy(variables)
+      processed_variables = CopyForListFilters(variables)
       ProcessListFiltersInDict(contents, processed_variables)
       # Recurse to expand variables in the contents
       contents = ExpandVariables(contents, phase,
@@ -865,6 +1087,18 @@ def ExpandVariables(input, phase, variables, build_file):
       # command's output so it is run every time.
       cache_key = (str(contents), build_file_dir)
       cached_value = cached_command_results.get(cache_key, None)
+      if cached_value is None and command_cache:
+        # Results from earlier runs of gyp can be used while the inputs of
+        # the command have not changed.
+        persistent_key = command_cache.Key(contents, build_file_dir)
+        inputs = command_cache.Inputs(contents, build_file_dir,
+                                      command_string)
+        cached_value = command_cache.Get(persistent_key, inputs)
+        if cached_value is not None:
+          gyp.DebugOutput(gyp.DEBUG_VARIABLES,
+                          "Had stored value for command '%s' in directory "
+                          "'%s'", contents, build_file_dir)
+          cached_command_results[cache_key] = cached_value
       if cached_value is None:
         gyp.DebugOutput(gyp.DEBUG_VARIABLES,
                         "Executing command '%s' in directory '%s'",
@@ -922,6 +1156,8 @@ def ExpandVariables(input, phase, variables, build_file):
           replacement = p_stdout.rstrip()
 
         cached_command_results[cache_key] = replacement
+        if command_cache:
+          command_cache.Put(persistent_key, inputs, replacement)
       else:
         gyp.DebugOutput(gyp.DEBUG_VARIABLES,
                         "Had cache value for command '%s' in directory '%s'",
@@ -2258,13 +2494,19 @@ def SetUpConfigurations(target, target_dict):
 
   merged_configurations = {}
   configs = target_dict['configurations']
-  for (configuration, old_configuration_dict) in configs.iteritems():
-    # Skip abstract configurations (saves work only).
-    if old_configuration_dict.get('abstract'):
-      continue
+  # Skip abstract configurations (saves work only).
+  concrete = [(configuration, old_configuration_dict)
+              for (configuration, old_configuration_dict) in configs.iteritems()
+              if not old_configuration_dict.get('abstract')]
+  for (configuration, old_configuration_dict) in concrete:
     # Configurations inherit (most) settings from the enclosing target scope.
     # Get the inheritance relationship right by making a copy of the target
-    # dict.
+    # dict.  The settings are removed from the target dict below, so the last
+    # configuration can take them over instead of copies.
+    if configuration == concrete[-1][0]:
+      copy_value = lambda value: value
+    else:
+      copy_value = gyp.simple_copy.deepcopy
     new_configuration_dict = {}
     for (key, target_val) in target_dict.iteritems():
       key_ext = key[-1:]
@@ -2273,7 +2515,7 @@ def SetUpConfigurations(target, target_dict):
       else:
         key_base = key
       if not key_base in non_configuration_keys:
-        new_configuration_dict[key] = gyp.simple_copy.deepcopy(target_val)
+        new_configuration_dict[key] = copy_value(target_val)
 
     # Merge in configuration (with all its parents first).
     MergeConfigWithInheritance(new_configuration_dict, build_file,
@@ -2483,6 +2725,40 @@ def ProcessListFiltersInList(name, the_list):
       ProcessListFiltersInList(name, item)
 
 
+def CopyForListFilters(value):
+  """Returns a copy of value that ProcessListFiltersInDict may modify.
+
+  Only the dicts and lists that the filters would change are copied; the rest
+  of the copy is shared with value, and value itself is returned when it holds
+  no filters at all.
+  """
+  if type(value) is dict:
+    copied = None
+    for k, v in value.iteritems():
+      new_v = CopyForListFilters(v)
+      if new_v is not v:
+        if copied is None:
+          copied = dict(value)
+        copied[k] = new_v
+    for k in value:
+      if k[-1:] not in ('!', '/'):
+        continue
+      if copied is None:
+        copied = dict(value)
+      list_key = k[:-1]
+      if type(copied.get(list_key)) is list and \
+         copied[list_key] is value[list_key]:
+        copied[list_key] = list(copied[list_key])
+    if copied is not None:
+      return copied
+  elif type(value) is list:
+    copied = [CopyForListFilters(item) for item in value]
+    for item, new_item in zip(value, copied):
+      if new_item is not item:
+        return copied
+  return value
+
+
 def ValidateTargetType(target, target_dict):
   """Ensures the 'type' field on the target is one of the known types.
 
@@ -2756,8 +3032,16 @@ def SetGeneratorGlobals(generator_input_info):
 
 
 def Load(build_files, variables, includes, depth, generator_input_info, check,
-         circular_check, duplicate_basename_check, parallel, root_targets):
+         circular_check, duplicate_basename_check, parallel, root_targets,
+         command_cache_path=None, build_file_cache_dir=None):
   SetGeneratorGlobals(generator_input_info)
+  global command_cache, build_file_cache
+  command_cache = None
+  if command_cache_path:
+    command_cache = CommandCache(command_cache_path)
+  build_file_cache = None
+  if build_file_cache_dir:
+    build_file_cache = BuildFileCache(build_file_cache_dir)
   # A generator can have other lists (in addition to sources) be processed
   # for rules.
   extra_sources_for_rules = generator_input_info['extra_sources_for_rules']
@@ -2900,4 +3184,9 @@ def Load(build_files, variables, includes, depth, generator_input_info, check,
   # TODO(mark): Return |data| for now because the generator needs a list of
   # build files that came in.  In the future, maybe it should just accept
   # a list, and not the whole data dict.
+  if command_cache:
+    command_cache.Save()
+  if build_file_cache:
+    build_file_cache.Save()
+
   return [flat_list, targets, data]
@@ -7,6 +7,10 @@
 """Unit tests for the input.py file."""
 
 import gyp.input
+import gyp.simple_copy
+import os
+import shutil
+import tempfile
 import unittest
 import sys
 
@@ -86,5 +90,196 @@ class TestFindCycles(unittest.TestCase):
                       self.nodes['a'].FindCycles())
 
 
+class TestCommandCache(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.build_file = os.path.join(self.dir, 'test.gyp')
+    self.cache_path = os.path.join(self.dir, 'out', 'commands.json')
+    self.runs = os.path.join(self.dir, 'runs')
+    self._write('script.py',
+                'open("runs", "a").write("x")\n'
+                'print("output")\n')
+    self.command = '<!(%s script.py)' % sys.executable
+    os.environ.pop('GYP_TEST_VALUE', None)
+
+  def tearDown(self):
+    gyp.input.command_cache = None
+    gyp.input.cached_command_results.clear()
+    os.environ.pop('GYP_TEST_VALUE', None)
+    shutil.rmtree(self.dir)
+
+  def _write(self, name, contents):
+    with open(os.path.join(self.dir, name), 'w') as f:
+      f.write(contents)
+
+  def _expand(self, command):
+    # Each call acts as a new run of gyp that reads the cache file.
+    gyp.input.cached_command_results.clear()
+    gyp.input.command_cache = gyp.input.CommandCache(self.cache_path)
+    result = gyp.input.ExpandVariables(command, gyp.input.PHASE_EARLY, {},
+                                       self.build_file)
+    gyp.input.command_cache.Save()
+    return result
+
+  def _run_count(self):
+    with open(self.runs) as f:
+      return len(f.read())
+
+  def test_reuses_output(self):
+    self.assertEqual('output', self._expand(self.command))
+    self.assertEqual('output', self._expand(self.command))
+    self.assertEqual(1, self._run_count())
+
+  def test_input_file_changed(self):
+    self._expand(self.command)
+    self._write('script.py',
+                'open("runs", "a").write("x")\n'
+                'print("changed")\n')
+    self.assertEqual('changed', self._expand(self.command))
+    self.assertEqual(2, self._run_count())
+
+  def test_environment_changed(self):
+    command = self.command[:-1] + ' $GYP_TEST_VALUE)'
+    self._expand(command)
+    self._expand(command)
+    os.environ['GYP_TEST_VALUE'] = '1'
+    self._expand(command)
+    self.assertEqual(2, self._run_count())
+
+  def test_output_is_str(self):
+    self._expand(self.command)
+    self.assertTrue(type(self._expand(self.command)) is str)
+
+
+class TestBuildFileCache(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.dir, 'out', 'build-files')
+    self.build_file = os.path.join(self.dir, 'test.gyp')
+    self._write('test.gyp', "{'includes': ['common.gypi'], 'targets': []}")
+    self._write('common.gypi', "{'variables': {'value': 1}}")
+    self.evaluated = []
+    self.checked_eval = gyp.input.CheckedEval
+    def CheckedEval(file_contents):
+      self.evaluated.append(file_contents)
+      return self.checked_eval(file_contents)
+    gyp.input.CheckedEval = CheckedEval
+
+  def tearDown(self):
+    gyp.input.CheckedEval = self.checked_eval
+    gyp.input.build_file_cache = None
+    shutil.rmtree(self.dir)
+
+  def _write(self, name, contents):
+    with open(os.path.join(self.dir, name), 'w') as f:
+      f.write(contents)
+
+  def _load(self):
+    # Each call acts as a new run of gyp that reads the cache directory.
+    del self.evaluated[:]
+    gyp.input.build_file_cache = gyp.input.BuildFileCache(self.cache_dir)
+    result = gyp.input.LoadOneBuildFile(self.build_file, {}, {}, None, True,
+                                        True)
+    gyp.input.build_file_cache.Save()
+    return result
+
+  def test_reuses_evaluated_files(self):
+    expected = self._load()
+    self.assertEqual(2, len(self.evaluated))
+    self.assertEqual(expected, self._load())
+    self.assertEqual([], self.evaluated)
+
+  def test_file_changed(self):
+    self._load()
+    self._write('common.gypi', "{'variables': {'value': 22}}")
+    self.assertEqual({'value': 22}, self._load()['variables'])
+    self.assertEqual(1, len(self.evaluated))
+
+  def test_results_are_not_shared(self):
+    self._load()['variables']['value'] = 2
+    self.assertEqual({'value': 1}, self._load()['variables'])
+
+  def test_removes_unused_entries(self):
+    self._load()
+    self._write('common.gypi', "{'variables': {'value': 22}}")
+    self._load()
+    # The index and one entry for each build file.
+    self.assertEqual(3, len(os.listdir(self.cache_dir)))
+
+  def test_keeps_other_files(self):
+    os.makedirs(os.path.join(self.cache_dir, 'a' * 40))
+    self._write(os.path.join('out', 'build-files', 'notes.txt'), '')
+    self._write(os.path.join('out', 'build-files', 'A' * 40), '')
+    self._load()
+    self._write('common.gypi', "{'variables': {'value': 22}}")
+    self._load()
+    names = os.listdir(self.cache_dir)
+    self.assertEqual(6, len(names))
+    for name in ('a' * 40, 'A' * 40, 'notes.txt'):
+      self.assertIn(name, names)
+
+
+class TestCopyForListFilters(unittest.TestCase):
+  def _check(self, value):
+    original = gyp.simple_copy.deepcopy(value)
+    expected = gyp.simple_copy.deepcopy(value)
+    gyp.input.ProcessListFiltersInDict('test', expected)
+    result = gyp.input.CopyForListFilters(value)
+    gyp.input.ProcessListFiltersInDict('test', result)
+    self.assertEqual(expected, result)
+    self.assertEqual(original, value)
+    return result
+
+  def test_without_filters(self):
+    value = {'sources': ['a.cc'], 'nested': {'list': [{'x': 1}]}}
+    self.assertTrue(self._check(value) is value)
+
+  def test_filters(self):
+    value = {'sources': ['a.cc', 'a_win.cc', 'b.cc'],
+             'sources!': ['b.cc'],
+             'sources/': [['exclude', '_win\\.cc$']],
+             'shared': ['c.cc']}
+    self.assertTrue(self._check(value)['shared'] is value['shared'])
+
+  def test_nested_filters(self):
+    value = {'outer': {'list': ['a', 'b'], 'list!': ['a']},
+             'items': [{'list': ['a', 'b'], 'list/': [['exclude', 'b']]},
+                       {'list': ['c']}],
+             'shared': {'list': ['d']}}
+    result = self._check(value)
+    self.assertTrue(result['items'][1] is value['items'][1])
+    self.assertTrue(result['shared'] is value['shared'])
+
+
+class TestSetUpConfigurations(unittest.TestCase):
+  def setUp(self):
+    self.non_configuration_keys = gyp.input.non_configuration_keys
+    gyp.input.non_configuration_keys = \
+        gyp.input.base_non_configuration_keys[:]
+
+  def tearDown(self):
+    gyp.input.non_configuration_keys = self.non_configuration_keys
+
+  def test_configurations_are_not_shared(self):
+    target_dict = {
+      'target_name': 'test',
+      'type': 'none',
+      'defines': ['SHARED'],
+      'configurations': {
+        'Common': {'abstract': 1, 'defines': ['COMMON']},
+        'Debug': {'inherit_from': ['Common'], 'defines': ['DEBUG']},
+        'Release': {'inherit_from': ['Common'], 'defines': ['RELEASE']},
+      },
+    }
+    gyp.input.SetUpConfigurations('test.gyp:test#target', target_dict)
+    configurations = target_dict['configurations']
+    self.assertEqual(['Debug', 'Release'], sorted(configurations))
+    self.assertEqual(['SHARED', 'COMMON', 'DEBUG'],
+                     configurations['Debug']['defines'])
+    self.assertEqual(['SHARED', 'COMMON', 'RELEASE'],
+                     configurations['Release']['defines'])
+    self.assertFalse('defines' in target_dict)
+
+
 if __name__ == '__main__':
   unittest.main()
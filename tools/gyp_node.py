@@ -34,6 +34,11 @@ def run_gyp(args):
 
   args.append('--depth=' + node_root)
 
+  # Remember what the generated files hold, so that regenerating them does not
+  # have to read the unchanged ones back.
+  args.append('--output-manifest=' +
+              os.path.join(output_dir, 'gyp-output-manifest.json'))
+
   # There's a bug with windows which doesn't allow this feature.
   if sys.platform != 'win32' and 'ninja' not in args:
     # Tell gyp to write the Makefiles into output_dir
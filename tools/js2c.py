@@ -32,10 +32,16 @@ This is a utility for converting JavaScript source code into uint16_t[],
 that are used for embedding JavaScript code into the Node.js binary.
 """
 import argparse
+import array
+import hashlib
+import json
+import multiprocessing
 import os
 import re
 import functools
 import codecs
+import sys
+import zlib
 
 def ReadFile(filename):
   if is_verbose:
@@ -66,52 +72,70 @@ def ExpandConstants(lines, constants):
   return lines
 
 
-def ExpandMacros(lines, macros):
-  def expander(s):
-    return ExpandMacros(s, macros)
+MACRO_ARGUMENT_PATTERN = re.compile('[,(){}\\[\\]]')
+
 
-  for name, macro in macros.items():
-    name_pattern = re.compile("\\b%s\\(" % name)
-    pattern_match = name_pattern.search(lines, 0)
+def ExpandMacros(lines, macros):
+  if not macros:
+    return lines
+  # A single alternation finds every macro call in one scan; the trailing
+  # '(' makes the order of the alternatives irrelevant.
+  name_pattern = re.compile('\\b(%s)\\(' % '|'.join(macros))
+
+  def expander(lines, active):
+    output = []
+    position = 0
+    pattern_match = name_pattern.search(lines, position)
     while pattern_match is not None:
+      name = pattern_match.group(1)
+      # An expansion is not rescanned for the macro that produced it.
+      if name in active:
+        pattern_match = name_pattern.search(lines, pattern_match.end())
+        continue
+      macro = macros[name]
       # Scan over the arguments
       height = 1
       start = pattern_match.start()
       end = pattern_match.end()
-      assert lines[end - 1] == '('
       last_match = end
-      arg_index = [0]  # Wrap state into array, to work around Python "scoping"
-      mapping = {}
-
-      def add_arg(s):
-        # Remember to expand recursively in the arguments
-        if arg_index[0] >= len(macro.args):
-          return
-        replacement = expander(s.strip())
-        mapping[macro.args[arg_index[0]]] = replacement
-        arg_index[0] += 1
-
-      while end < len(lines) and height > 0:
+      args = []
+      while height > 0:
+        delimiter = MACRO_ARGUMENT_PATTERN.search(lines, end)
+        if delimiter is None:
+          end = len(lines)
+          break
+        end = delimiter.end()
+        char = lines[end - 1]
         # We don't count commas at higher nesting levels.
-        if lines[end] == ',' and height == 1:
-          add_arg(lines[last_match:end])
-          last_match = end + 1
-        elif lines[end] in ['(', '{', '[']:
+        if char == ',':
+          if height == 1:
+            args.append(lines[last_match:end - 1])
+            last_match = end
+        elif char in '({[':
           height = height + 1
-        elif lines[end] in [')', '}', ']']:
+        else:
           height = height - 1
-        end = end + 1
       # Remember to add the last match.
-      add_arg(lines[last_match:end - 1])
-      if arg_index[0] < len(macro.args) - 1:
+      args.append(lines[last_match:end - 1])
+      if len(args) < len(macro.args) - 1:
         lineno = lines.count(os.linesep, 0, start) + 1
         raise Exception(
           'line %s: Too few arguments for macro "%s"' % (lineno, name))
+      # Remember to expand recursively in the arguments
+      mapping = {}
+      for arg, value in zip(macro.args, args):
+        mapping[arg] = expander(value.strip(), active)
       result = macro.expand(mapping)
-      # Replace the occurrence of the macro with the expansion
-      lines = lines[:start] + result + lines[end:]
-      pattern_match = name_pattern.search(lines, start + len(result))
-  return lines
+      output.append(lines[position:start])
+      output.append(expander(result, active | frozenset([name])))
+      position = end
+      pattern_match = name_pattern.search(lines, position)
+    if position == 0:
+      return lines
+    output.append(lines[position:])
+    return ''.join(output)
+
+  return expander(lines, frozenset())
 
 
 class TextMacro:
@@ -190,16 +214,35 @@ namespace native_module {{
 void NativeModuleLoader::LoadJavaScriptSource() {{
   {1}
 }}
+{2}
+}}  // namespace native_module
 
-UnionBytes NativeModuleLoader::GetConfig() {{
-  return UnionBytes(config_raw, {2});  // config.gypi
-}}
+}}  // namespace node
+"""
 
+# Used when config.gypi is emitted into its own translation unit, so that
+# changing configure options does not regenerate and recompile all modules.
+CONFIG_TEMPLATE = """
+#include "node_native_module.h"
+#include "util-inl.h"
+
+namespace node {{
+
+namespace native_module {{
+
+{0}
+{1}
 }}  // namespace native_module
 
 }}  // namespace node
 """
 
+CONFIG_GETTER = """
+UnionBytes NativeModuleLoader::GetConfig() {{
+  return UnionBytes({0}, {1});  // config.gypi
+}}
+"""
+
 ONE_BYTE_STRING = """
 static const uint8_t {0}[] = {{
 {1}
@@ -214,46 +257,119 @@ static const uint16_t {0}[] = {{
 
 INITIALIZER = 'source_.emplace("{0}", UnionBytes{{{1}, {2}}});'
 
+COMPRESSED_INITIALIZER = (
+    'source_.emplace("{0}", UnionBytes{{{1} + {2}, {3}, {4}, {5}}});')
+
 CONFIG_GYPI_ID = 'config_raw'
 
+COMPRESSED_SOURCES_ID = 'compressed_sources_raw'
+
 SLUGGER_RE =re.compile('[.\-/]')
 
 is_verbose = False
 
+RAW_STRING = """
+static const char {0}_chars[] = R"{2}({1}){2}";
+static const uint8_t* const {0} =
+    reinterpret_cast<const uint8_t*>({0}_chars);
+"""
+
+RAW_STRING_DELIMITER = 'js2c'
+
+# Characters other than these may be changed by the compiler, or are not
+# allowed in source files.
+NON_RAW_STRING_RE = re.compile('[^\t\n\x0b\x0c\x20-\x7e]')
+
+use_raw_strings = False
+
+use_compression = False
+
+def GetCodeUnits(source):
+  """Returns the source as an array of code units and whether they are bytes.
+
+  ASCII sources are stored one byte per character. Anything else is encoded
+  as UTF-16 and stored in two-byte code units.
+  """
+  try:
+    return bytearray(source.encode('ascii')), True
+  except UnicodeEncodeError:
+    code_units = array.array('H')
+    encoded = source.encode('utf-16le')
+    if hasattr(code_units, 'frombytes'):
+      code_units.frombytes(encoded)
+    else:
+      code_units.fromstring(encoded)
+    if sys.byteorder == 'big':
+      code_units.byteswap()
+    return code_units, False
+
+
+# For easier debugging, align to the common 3 char for code-points.
+FORMATTED_BYTES = ['%3s' % byte for byte in range(256)]
+
+def FormatCodeUnits(code_units, step):
+  """Formats code units as the body of a C array, `step` units per line."""
+  if isinstance(code_units, bytearray):
+    # ASCII code units all take up three characters and a comma, so the
+    # lines can be cut from one string.
+    content = ','.join(map(FORMATTED_BYTES.__getitem__, code_units))
+    width = 4 * step
+    return ',\n'.join(content[i:i + width - 1]
+                       for i in range(0, len(content), width))
+  row = ','.join(['%3s'] * step)
+  full = len(code_units) - len(code_units) % step
+  lines = [row % tuple(code_units[i:i + step]) for i in range(0, full, step)]
+  if full < len(code_units):
+    rest = code_units[full:]
+    lines.append(','.join(['%3s'] * len(rest)) % tuple(rest))
+  return ',\n'.join(lines)
+
+
+def CanUseRawString(source):
+  """Whether a C++ raw string literal reproduces the source exactly."""
+  return (NON_RAW_STRING_RE.search(source) is None and
+          ')%s"' % RAW_STRING_DELIMITER not in source)
+
+
 def GetDefinition(var, source, step=30):
-  template = ONE_BYTE_STRING
-  code_points = [ord(c) for c in source]
-  if any(c > 127 for c in code_points):
-    template = TWO_BYTE_STRING
-    # Treat non-ASCII as UTF-8 and encode as UTF-16 Little Endian.
-    encoded_source = bytearray(source, 'utf-16le')
-    code_points = [
-      encoded_source[i] + (encoded_source[i + 1] * 256)
-      for i in range(0, len(encoded_source), 2)
-    ]
-
-  # For easier debugging, align to the common 3 char for code-points.
-  elements_s = ['%3s' % x for x in code_points]
-  # Put no more then `step` code-points in a line.
-  slices = [elements_s[i:i + step] for i in range(0, len(elements_s), step)]
-  lines = [','.join(s) for s in slices]
-  array_content = ',\n'.join(lines)
-  definition = template.format(var, array_content)
-
-  return definition, len(code_points)
-
-
-def AddModule(filename, consts, macros, definitions, initializers):
+  code_units, one_byte = GetCodeUnits(source)
+  if use_raw_strings and one_byte and CanUseRawString(source):
+    definition = RAW_STRING.format(var, source, RAW_STRING_DELIMITER)
+  else:
+    template = ONE_BYTE_STRING if one_byte else TWO_BYTE_STRING
+    definition = template.format(var, FormatCodeUnits(code_units, step))
+
+  return definition, len(code_units)
+
+
+def GetCompressedDefinition(source, step=30):
+  """Returns the source compressed with zlib, formatted as a piece of the
+  compressed sources array, with its size and compressed size and whether
+  it is stored in bytes.
+
+  Two-byte sources are compressed as little-endian UTF-16.
+  """
+  try:
+    data, one_byte = source.encode('ascii'), True
+  except UnicodeEncodeError:
+    data, one_byte = source.encode('utf-16le'), False
+  compressed = bytearray(zlib.compress(data, 9))
+  size = len(data) if one_byte else len(data) // 2
+  return FormatCodeUnits(compressed, step), size, len(compressed), one_byte
+
+
+def GetModuleVar(filename):
+  slug = SLUGGER_RE.sub('_', NormalizeFileName(filename))
+  return slug + '_raw'
+
+
+def GetModuleDefinition(filename, consts, macros):
   code = ReadFile(filename)
   code = ExpandConstants(code, consts)
   code = ExpandMacros(code, macros)
-  name = NormalizeFileName(filename)
-  slug = SLUGGER_RE.sub('_', name)
-  var = slug + '_raw'
-  definition, size = GetDefinition(var, code)
-  initializer = INITIALIZER.format(name, var, size)
-  definitions.append(definition)
-  initializers.append(initializer)
+  if use_compression:
+    return GetCompressedDefinition(code)
+  return GetDefinition(GetModuleVar(filename), code)
 
 def NormalizeFileName(filename):
   split = filename.split(os.path.sep)
@@ -265,27 +381,169 @@ def NormalizeFileName(filename):
   return os.path.splitext(filename)[0]
 
 
-def JS2C(source_files, target):
+class FragmentCache(object):
+  """Stores the generated definition of each module in a directory.
+
+  Each definition is stored in a file named after a hash of the module's
+  name and source, the macro files, the output mode and js2c itself, so a
+  module is only generated again when one of those has changed.
+  """
+
+  def __init__(self, directory, macro_files):
+    self.directory = directory
+    self.used = set()
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.digest = hashlib.sha1()
+    self.AddFile(self.digest, os.path.splitext(__file__)[0] + '.py')
+    if use_compression:
+      self.digest.update(b'compressed')
+    else:
+      self.digest.update(b'raw' if use_raw_strings else b'array')
+    for filename in macro_files:
+      self.AddFile(self.digest, filename)
+
+  @staticmethod
+  def AddFile(digest, filename):
+    digest.update(filename.encode('utf-8') + b'\0')
+    with open(filename, 'rb') as f:
+      digest.update(f.read())
+    digest.update(b'\0')
+
+  def Key(self, filename):
+    digest = self.digest.copy()
+    self.AddFile(digest, filename)
+    return digest.hexdigest()
+
+  def Path(self, key):
+    return os.path.join(self.directory, key + '.json')
+
+  def Get(self, key):
+    """Returns the stored fragment for a key, or None."""
+    self.used.add(key)
+    try:
+      with open(self.Path(key)) as f:
+        return tuple(json.load(f)['fragment'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+      return None
+
+  def Put(self, key, fragment):
+    path = self.Path(key)
+    with open(path + '.tmp', 'w') as f:
+      json.dump({'fragment': fragment}, f)
+    if os.path.exists(path):
+      os.remove(path)
+    os.rename(path + '.tmp', path)
+
+  def Prune(self):
+    """Removes the fragments that were not used by this run."""
+    for name in os.listdir(self.directory):
+      if os.path.splitext(name)[0] not in self.used:
+        os.remove(os.path.join(self.directory, name))
+
+
+worker_macros = None
+
+def InitWorker(macro_files, verbose, raw_strings, compression):
+  global is_verbose, use_raw_strings, use_compression, worker_macros
+  is_verbose = verbose
+  use_raw_strings = raw_strings
+  use_compression = compression
+  worker_macros = ReadMacros(macro_files)
+
+
+def GenerateModule(filename):
+  consts, macros = worker_macros
+  return GetModuleDefinition(filename, consts, macros)
+
+
+def GenerateModules(filenames, consts, macros, macro_files, jobs):
+  """Returns the fragment generated for each module, in order.
+
+  A fragment is the (definition, size) of the module's array, or the
+  result of GetCompressedDefinition when compressing.
+  """
+  if jobs <= 1 or len(filenames) <= 1:
+    return [GetModuleDefinition(f, consts, macros) for f in filenames]
+  pool = multiprocessing.Pool(min(jobs, len(filenames)), InitWorker,
+                              (macro_files, is_verbose, use_raw_strings,
+                               use_compression))
+  try:
+    return pool.map(GenerateModule, filenames)
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def JS2C(source_files, target, cache_dir=None, jobs=1):
   # Process input from all *macro.py files
   consts, macros = ReadMacros(source_files['.py'])
 
+  # Reuse the definitions of modules that have not changed
+  modules = source_files['.js']
+  cache = None
+  fragments = [None] * len(modules)
+  if cache_dir:
+    cache = FragmentCache(cache_dir, source_files['.py'])
+    keys = [cache.Key(filename) for filename in modules]
+    fragments = [cache.Get(key) for key in keys]
+  stale = [f for f, fragment in zip(modules, fragments) if fragment is None]
+  generated = iter(GenerateModules(stale, consts, macros, source_files['.py'],
+                                   jobs))
+
   # Build source code lines
   definitions = []
   initializers = []
+  # When compressing, all modules share one array and each initializer
+  # holds the offset of its module in it.
+  compressed = []
+  offset = 0
+
+  for i, filename in enumerate(modules):
+    if fragments[i] is None:
+      fragments[i] = next(generated)
+      if cache:
+        cache.Put(keys[i], fragments[i])
+    if use_compression:
+      definition, size, compressed_size, one_byte = fragments[i]
+      initializer = COMPRESSED_INITIALIZER.format(
+          NormalizeFileName(filename), COMPRESSED_SOURCES_ID, offset,
+          compressed_size, size, 'true' if one_byte else 'false')
+      compressed.append(definition)
+      offset += compressed_size
+    else:
+      definition, size = fragments[i]
+      initializer = INITIALIZER.format(NormalizeFileName(filename),
+                                       GetModuleVar(filename), size)
+      definitions.append(definition)
+    initializers.append(initializer)
+
+  if cache:
+    cache.Prune()
 
-  for filename in source_files['.js']:
-    AddModule(filename, consts, macros, definitions, initializers)
+  if use_compression:
+    definitions.append(ONE_BYTE_STRING.format(COMPRESSED_SOURCES_ID,
+                                              ',\n'.join(compressed)))
 
-  config_def, config_size = handle_config_gypi(source_files['config.gypi'])
-  definitions.append(config_def)
+  config_getter = ''
+  if 'config.gypi' in source_files:
+    config_def, config_size = handle_config_gypi(source_files['config.gypi'])
+    definitions.append(config_def)
+    config_getter = CONFIG_GETTER.format(CONFIG_GYPI_ID, config_size)
 
   # Emit result
   definitions = ''.join(definitions)
   initializers = '\n  '.join(initializers)
-  out = TEMPLATE.format(definitions, initializers, config_size)
+  out = TEMPLATE.format(definitions, initializers, config_getter)
   write_if_chaged(out, target)
 
 
+def JS2CConfig(config_filename, target):
+  config_def, config_size = handle_config_gypi(config_filename)
+  config_getter = CONFIG_GETTER.format(CONFIG_GYPI_ID, config_size)
+  write_if_chaged(CONFIG_TEMPLATE.format(config_def, config_getter), target)
+
+
 def handle_config_gypi(config_filename):
   # if its a gypi file we're going to want it as json
   # later on anyway, so get it out of the way now
@@ -335,17 +593,37 @@ def main():
   )
   parser.add_argument('--target', help='output file')
   parser.add_argument('--verbose', action='store_true', help='output file')
+  parser.add_argument('--raw-string-literals', action='store_true',
+                      help='embed ASCII sources as C++ raw string literals '
+                           'instead of arrays (not supported by MSVC)')
+  parser.add_argument('--compress', action='store_true',
+                      help='embed the sources compressed with zlib in one '
+                           'array, to be inflated when first used')
+  parser.add_argument('--cache-dir',
+                      help='directory to keep the code generated for each '
+                           'module in, so unchanged modules are reused')
+  parser.add_argument('--jobs', type=int, default=1,
+                      help='number of processes to generate modules with')
   parser.add_argument('sources', nargs='*', help='input files')
   options = parser.parse_args()
-  global is_verbose
+  global is_verbose, use_raw_strings, use_compression
   is_verbose = options.verbose
+  use_raw_strings = options.raw_string_literals
+  use_compression = options.compress
   source_files = functools.reduce(SourceFileByExt, options.sources, {})
-  # Should have exactly 3 types: `.js`, `.py`, and `.gypi`
-  assert len(source_files) == 3
   # Currently config.gypi is the only `.gypi` file allowed
-  assert source_files['.gypi'] == ['config.gypi']
-  source_files['config.gypi'] = source_files.pop('.gypi')[0]
-  JS2C(source_files, options.target)
+  assert source_files.get('.gypi', ['config.gypi']) == ['config.gypi']
+  if '.js' not in source_files:
+    # Only config.gypi, which gets a translation unit of its own
+    assert list(source_files) == ['.gypi']
+    JS2CConfig(source_files['.gypi'][0], options.target)
+    return
+  # Should have `.js` and `.py` files, and `.gypi` unless config.gypi is
+  # emitted on its own
+  assert set(source_files) - set(['.gypi']) == set(['.js', '.py'])
+  if '.gypi' in source_files:
+    source_files['config.gypi'] = source_files.pop('.gypi')[0]
+  JS2C(source_files, options.target, options.cache_dir, options.jobs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,24 @@
+'use strict';
+// Preloaded through NODE_OPTIONS by tools/test.py --record-deps. When the
+// process exits, appends the files it loaded as one JSON line to the file
+// named by NODE_TEST_DEPS_FILE. Child processes inherit both variables, so
+// their dependencies are recorded for the test as well.
+const fs = require('fs');
+const Module = require('module');
+
+const output = process.env.NODE_TEST_DEPS_FILE;
+
+if (output) {
+  process.on('exit', () => {
+    const files = Object.keys(Module._cache);
+    for (const entry of process.moduleLoadList) {
+      if (entry.startsWith('NativeModule '))
+        files.push(`lib/${entry.slice('NativeModule '.length)}.js`);
+    }
+    try {
+      fs.appendFileSync(output, `${JSON.stringify(files)}\n`);
+    } catch {
+      // The test may have cleaned up its environment; nothing to record.
+    }
+  });
+}
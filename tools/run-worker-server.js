@@ -0,0 +1,66 @@
+'use strict';
+// Used by tools/test.py --worker-pool. Reads one JSON request per line from
+// stdin, runs the requested test file in a fresh Worker and answers with one
+// JSON line holding its exit code and output. The process stays alive so
+// that node's startup cost is paid once per test thread instead of once per
+// test.
+if (typeof require === 'undefined') {
+  console.log('1..0 # Skipped: Not being run as CommonJS');
+  process.exit(0);
+}
+
+const path = require('path');
+const readline = require('readline');
+const { inspect } = require('util');
+const { Worker } = require('worker_threads');
+
+const queue = [];
+let running = false;
+
+function collect(stream, result, key) {
+  stream.setEncoding('utf8');
+  stream.on('data', (chunk) => result[key] += chunk);
+  return new Promise((resolve) => stream.on('end', resolve));
+}
+
+function run({ file, env }) {
+  const result = { exitCode: null, stdout: '', stderr: '' };
+  const worker = new Worker(path.resolve(process.cwd(), file), {
+    env,
+    stdout: true,
+    stderr: true
+  });
+  const exited = new Promise((resolve) => {
+    worker.on('error', (err) => result.stderr += `${inspect(err)}\n`);
+    worker.on('exit', (code) => {
+      result.exitCode = code;
+      resolve();
+    });
+  });
+  return Promise.all([
+    exited,
+    collect(worker.stdout, result, 'stdout'),
+    collect(worker.stderr, result, 'stderr')
+  ]).then(() => result);
+}
+
+function next() {
+  if (running || queue.length === 0)
+    return;
+  running = true;
+  const request = queue.shift();
+  Promise.resolve()
+    .then(() => run(request))
+    .catch((err) => ({ exitCode: 1, stdout: '', stderr: `${inspect(err)}\n` }))
+    .then((result) => {
+      process.stdout.write(`${JSON.stringify(result)}\n`);
+      running = false;
+      next();
+    });
+}
+
+readline.createInterface({ input: process.stdin })
+  .on('line', (line) => {
+    queue.push(JSON.parse(line));
+    next();
+  });
@@ -30,9 +30,12 @@
 
 from __future__ import print_function
 import imp
+import io
+import json
 import logging
 import optparse
 import os
+import pickle
 import re
 import signal
 import subprocess
@@ -42,8 +45,11 @@ import time
 import threading
 import utils
 import multiprocessing
+import zlib
 import errno
 import copy
+import heapq
+import itertools
 
 from os.path import join, dirname, abspath, basename, isdir, exists
 from datetime import datetime
@@ -79,12 +85,16 @@ class ProgressIndicator(object):
     self.cases = cases
     self.flaky_tests_mode = flaky_tests_mode
     self.parallel_queue = Queue(len(cases))
+    self.overlap_queue = Queue(len(cases))
     self.sequential_queue = Queue(len(cases))
-    for case in cases:
-      if case.parallel:
-        self.parallel_queue.put_nowait(case)
-      else:
-        self.sequential_queue.put_nowait(case)
+    self.history = None
+    self.overlap = False
+    self.flakiness = None
+    self.retries = 0
+    self.isolated = [ ]
+    self.tasks = 1
+    self.parallel_work = 0
+    self.overlap_work = 0
     self.succeeded = 0
     self.remaining = len(cases)
     self.total = len(cases)
@@ -94,6 +104,62 @@ class ProgressIndicator(object):
     self.lock = threading.Lock()
     self.shutdown_event = threading.Event()
 
+  def Schedule(self, history):
+    """Fills the queues. With a duration history the parallel tests are
+    handed out longest first. With --overlap-sequential, sequential tests
+    that are not marked flaky may also start on the main thread while the
+    other threads are still working through the end of the parallel queue.
+    Otherwise sequential tests only start once the parallel queue is
+    empty."""
+    self.history = history
+    cases = self.cases
+    if self.flakiness is not None:
+      # Tests that have flaked before go straight to the isolated lane.
+      self.isolated = [c for c in cases if self.flakiness.ShouldIsolate(c)]
+      cases = [c for c in cases if c not in self.isolated]
+    parallel = [c for c in cases if c.parallel]
+    sequential = [c for c in cases if not c.parallel]
+    if history is not None:
+      for case in self.cases:
+        case.predicted_duration = history.Predict(case)
+      parallel.sort(key=lambda c: c.predicted_duration, reverse=True)
+      self.parallel_work = sum(c.predicted_duration for c in parallel)
+    for case in parallel:
+      self.parallel_queue.put_nowait(case)
+    for case in sequential:
+      if self.overlap and history is not None and FLAKY not in case.outcomes:
+        self.overlap_queue.put_nowait(case)
+        self.overlap_work += case.predicted_duration
+      else:
+        self.sequential_queue.put_nowait(case)
+
+  def ShouldOverlap(self):
+    # Start the sequential tests once the parallel work left for the other
+    # threads no longer exceeds the sequential work left for this one.
+    if self.tasks < 2 or self.overlap_queue.empty():
+      return False
+    return self.parallel_work / (self.tasks - 1) <= self.overlap_work
+
+  def NextTest(self, parallel):
+    if not parallel:
+      self.lock.acquire()
+      overlap = self.ShouldOverlap()
+      self.lock.release()
+      if overlap:
+        try:
+          return self.overlap_queue.get_nowait()
+        except Empty:
+          pass
+    queues = [self.parallel_queue]
+    if not parallel:
+      queues += [self.overlap_queue, self.sequential_queue]
+    for queue in queues:
+      try:
+        return queue.get_nowait()
+      except Empty:
+        pass
+    return None
+
   def PrintFailureHeader(self, test):
     if test.IsNegative():
       negative_marker = '[negative] '
@@ -105,7 +171,13 @@ class ProgressIndicator(object):
     })
     print("Path: %s" % "/".join(test.path))
 
-  def Run(self, tasks):
+  def Run(self, tasks, history=None, retries=0, flakiness=None,
+          overlap=False):
+    self.tasks = tasks
+    self.overlap = overlap
+    self.retries = retries
+    self.flakiness = flakiness
+    self.Schedule(history)
     self.Starting()
     threads = []
     # Spawn N-1 threads and then use this thread as the last one.
@@ -121,6 +193,7 @@ class ProgressIndicator(object):
       for thread in threads:
         # Use a timeout so that signals (ctrl-c) will be processed.
         thread.join(timeout=10000000)
+      self.RunIsolated()
     except (KeyboardInterrupt, SystemExit):
       self.shutdown_event.set()
     except Exception:
@@ -134,50 +207,87 @@ class ProgressIndicator(object):
 
   def RunSingle(self, parallel, thread_id):
     while not self.shutdown_event.is_set():
-      try:
-        test = self.parallel_queue.get_nowait()
-      except Empty:
-        if parallel:
-          return
-        try:
-          test = self.sequential_queue.get_nowait()
-        except Empty:
-          return
-      case = test
+      case = self.NextTest(parallel)
+      if case is None:
+        return
       case.thread_id = thread_id
       self.lock.acquire()
+      if self.history is not None:
+        if case.parallel:
+          self.parallel_work -= case.predicted_duration
+        elif self.overlap and FLAKY not in case.outcomes:
+          self.overlap_work -= case.predicted_duration
       self.AboutToRun(case)
       self.lock.release()
       try:
-        start = datetime.now()
-        output = case.Run()
-        # SmartOS has a bug that causes unexpected ECONNREFUSED errors.
-        # See https://smartos.org/bugview/OS-2767
-        # If ECONNREFUSED on SmartOS, retry the test one time.
-        if (output.UnexpectedOutput() and
-          sys.platform == 'sunos5' and
-          'ECONNREFUSED' in output.output.stderr):
-            output = case.Run()
-            output.diagnostic.append('ECONNREFUSED received, test retried')
-        case.duration = (datetime.now() - start)
+        output = self.RunCase(case)
       except IOError:
         return
       if self.shutdown_event.is_set():
         return
       self.lock.acquire()
-      if output.UnexpectedOutput():
-        if FLAKY in output.test.outcomes and self.flaky_tests_mode == DONTCARE:
-          self.flaky_failed.append(output)
-        else:
-          self.failed.append(output)
-          if output.HasCrashed():
-            self.crashed += 1
+      if output.UnexpectedOutput() and self.retries > 0:
+        # Retry later in the isolated lane, without competing for resources.
+        case.failures += 1
+        self.isolated.append(case)
       else:
-        self.succeeded += 1
-      self.remaining -= 1
-      self.HasRun(output)
+        self.Report(output)
       self.lock.release()
 
+  def RunCase(self, case):
+    start = datetime.now()
+    output = case.Run()
+    # SmartOS has a bug that causes unexpected ECONNREFUSED errors.
+    # See https://smartos.org/bugview/OS-2767
+    # If ECONNREFUSED on SmartOS, retry the test one time.
+    if (output.UnexpectedOutput() and
+      sys.platform == 'sunos5' and
+      'ECONNREFUSED' in output.output.stderr):
+        output = case.Run()
+        output.diagnostic.append('ECONNREFUSED received, test retried')
+    case.duration = (datetime.now() - start)
+    if self.history is not None and not output.HasTimedOut():
+      self.lock.acquire()
+      self.history.Record(case)
+      self.lock.release()
+    return output
+
+  def RunIsolated(self):
+    """Runs the tests that failed or have flaked before one at a time, after
+    everything else has finished, retrying each up to self.retries times."""
+    for case in self.isolated:
+      while not self.shutdown_event.is_set():
+        self.lock.acquire()
+        self.AboutToRun(case)
+        self.lock.release()
+        output = self.RunCase(case)
+        if not output.UnexpectedOutput():
+          break
+        case.failures += 1
+        if case.failures > self.retries:
+          break
+      if self.shutdown_event.is_set():
+        return
+      self.lock.acquire()
+      self.Report(output)
+      self.lock.release()
+
+  def Report(self, output):
+    # Must be called with self.lock held.
+    if self.flakiness is not None:
+      self.flakiness.Record(output.test, not output.UnexpectedOutput())
+    if output.UnexpectedOutput():
+      if FLAKY in output.test.outcomes and self.flaky_tests_mode == DONTCARE:
+        self.flaky_failed.append(output)
+      else:
+        self.failed.append(output)
+        if output.HasCrashed():
+          self.crashed += 1
+    else:
+      self.succeeded += 1
+    self.remaining -= 1
+    self.HasRun(output)
+
 
 def EscapeCommand(command):
   parts = []
@@ -486,11 +596,12 @@ PROGRESS_INDICATORS = {
 
 class CommandOutput(object):
 
-  def __init__(self, exit_code, timed_out, stdout, stderr):
+  def __init__(self, exit_code, timed_out, stdout, stderr, usage=None):
     self.exit_code = exit_code
     self.timed_out = timed_out
     self.stdout = stdout
     self.stderr = stderr
+    self.usage = usage
     self.failed = None
 
 
@@ -505,6 +616,9 @@ class TestCase(object):
     self.parallel = False
     self.disable_core_files = False
     self.thread_id = 0
+    self.predicted_duration = None
+    self.usage = None
+    self.failures = 0
 
   def IsNegative(self):
     return self.context.expect_fail
@@ -520,25 +634,49 @@ class TestCase(object):
   def GetSource(self):
     return "(no source available)"
 
+  def CanUseWorkerPool(self, command, full_command):
+    # Only plain `node test.js` invocations of parallel tests qualify; flags,
+    # special commands and core file settings need a process of their own.
+    return (self.context.worker_pool is not None and
+            self.context.deps_recorder is None and
+            self.parallel and
+            not self.disable_core_files and
+            full_command == command and
+            len(command) == 2 and
+            command[1].endswith('.js'))
+
   def RunCommand(self, command, env):
     full_command = self.context.processor(command)
-    output = Execute(full_command,
-                     self.context,
-                     self.context.GetTimeout(self.mode),
-                     env,
-                     disable_core_files = self.disable_core_files)
+    if self.CanUseWorkerPool(command, full_command):
+      output = self.context.worker_pool.Execute(full_command,
+                                                self.context,
+                                                self.context.GetTimeout(self.mode),
+                                                env,
+                                                self.thread_id)
+    else:
+      output = Execute(full_command,
+                       self.context,
+                       self.context.GetTimeout(self.mode),
+                       env,
+                       disable_core_files = self.disable_core_files)
     return TestOutput(self,
                       full_command,
                       output,
                       self.context.store_unexpected_output)
 
   def Run(self):
+    env = {
+      "TEST_THREAD_ID": "%d" % self.thread_id,
+      "TEST_PARALLEL" : "%d" % self.parallel
+    }
+    deps_file = None
+    if self.context.deps_recorder is not None:
+      deps_file = self.context.deps_recorder.Prepare(env)
     try:
-      result = self.RunCommand(self.GetCommand(), {
-        "TEST_THREAD_ID": "%d" % self.thread_id,
-        "TEST_PARALLEL" : "%d" % self.parallel
-      })
+      result = self.RunCommand(self.GetCommand(), env)
     finally:
+      if deps_file is not None:
+        self.context.deps_recorder.Collect(self, deps_file)
       # Tests can leave the tty in non-blocking mode. If the test runner
       # tries to print to stdout/stderr after that and the tty buffer is
       # full, it'll die with a EAGAIN OSError. Ergo, put the tty back in
@@ -548,6 +686,7 @@ class TestCase(object):
         from os import O_NONBLOCK
         for fd in 0,1,2: fcntl(fd, F_SETFL, ~O_NONBLOCK & fcntl(fd, F_GETFL))
 
+    self.usage = result.output.usage
     return result
 
 
@@ -598,6 +737,9 @@ def KillProcessWithID(pid, signal_to_send=signal.SIGTERM):
     os.kill(pid, signal_to_send)
 
 
+# The backoff schedule RunProcess used to poll children with. The supervisor
+# still polls with it where os.waitid() is missing, and --time uses it to
+# estimate how much latency the supervisor saves.
 MAX_SLEEP_TIME = 0.1
 INITIAL_SLEEP_TIME = 0.0001
 SLEEP_TIME_FACTOR = 1.25
@@ -625,7 +767,205 @@ def KillTimedOutProcess(context, pid):
   KillProcessWithID(pid, signal_to_send)
 
 
-def RunProcess(context, timeout, args, **rest):
+def PollingLatency(runtime):
+  """Estimates how long the old poll()/sleep() loop would have kept a worker
+  thread busy after a child that ran for |runtime| seconds had exited."""
+  elapsed = 0
+  sleep_time = INITIAL_SLEEP_TIME
+  while elapsed < runtime:
+    elapsed += sleep_time
+    sleep_time = min(sleep_time * SLEEP_TIME_FACTOR, MAX_SLEEP_TIME)
+  # The loop also slept once more after the poll that saw the exit.
+  return elapsed - runtime + sleep_time
+
+
+def WaitForExit(process):
+  """Blocks until |process| exits without reaping it, so that its pid cannot
+  be recycled while the supervisor may still decide to kill it. Requires
+  os.waitid()."""
+  while True:
+    try:
+      os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+      return
+    except OSError as e:
+      if e.errno == errno.EINTR:
+        continue
+      if e.errno == errno.ECHILD:
+        return
+      raise
+
+
+class ResourceUsage(object):
+  """What a test's process consumed, as reported by wait4()."""
+
+  def __init__(self, rusage):
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else.
+    self.max_rss = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+      self.max_rss //= 1024
+    self.user_time = rusage.ru_utime
+    self.system_time = rusage.ru_stime
+    self.minor_faults = rusage.ru_minflt
+    self.major_faults = rusage.ru_majflt
+
+  def CpuTime(self):
+    return self.user_time + self.system_time
+
+  def ToDict(self):
+    return {
+      'max_rss_kb': self.max_rss,
+      'user_time': self.user_time,
+      'system_time': self.system_time,
+      'minor_faults': self.minor_faults,
+      'major_faults': self.major_faults
+    }
+
+
+def Reap(entry, block=True):
+  """Waits for and reaps a child, with wait4() where available so that its
+  resource usage can be recorded. The exit code is stored where Popen would
+  have stored it. With |block| false, returns None if the child is still
+  running."""
+  process = entry.process
+  if not hasattr(os, 'wait4'):
+    if block:
+      return process.wait()
+    return process.poll()
+  while True:
+    try:
+      (pid, status, rusage) = os.wait4(process.pid, 0 if block else os.WNOHANG)
+      break
+    except OSError as e:
+      if e.errno == errno.EINTR:
+        continue
+      if e.errno == errno.ECHILD:
+        return process.wait()
+      raise
+  if pid == 0:
+    return None
+  entry.usage = ResourceUsage(rusage)
+  if os.WIFSIGNALED(status):
+    process.returncode = -os.WTERMSIG(status)
+  else:
+    process.returncode = os.WEXITSTATUS(status)
+  return process.returncode
+
+
+class SupervisedProcess(object):
+
+  def __init__(self, context, process, deadline):
+    self.context = context
+    self.process = process
+    self.deadline = deadline
+    self.start = time.time()
+    self.finished = False
+    self.timed_out = False
+    self.usage = None
+
+
+class ProcessSupervisor(object):
+  """Enforces the timeouts of all running tests from a single thread.
+
+  Worker threads block on their own child and resume as soon as it exits.
+  The supervisor thread keeps the deadlines of the running children in a
+  heap and sleeps until the earliest one, so nobody polls.
+
+  Where os.waitid() is missing (Python 2, macOS), a child cannot be waited
+  for without reaping it, and a reaped pid may be reused before a timeout
+  kills it. Children with a deadline are then polled with the old backoff
+  instead, with the supervisor lock held (see PollAndReap)."""
+
+  def __init__(self):
+    self.cv = threading.Condition()
+    self.deadlines = []
+    self.sequence = itertools.count()
+    self.thread = None
+    self.estimated_latency_saved = 0.0
+
+  def Watch(self, context, process, timeout):
+    if timeout is None:
+      deadline = None
+    else:
+      deadline = time.time() + timeout
+    entry = SupervisedProcess(context, process, deadline)
+    if deadline is not None:
+      self.cv.acquire()
+      try:
+        heapq.heappush(self.deadlines,
+                       (deadline, next(self.sequence), entry))
+        if self.thread is None:
+          self.thread = threading.Thread(target=self.Supervise)
+          self.thread.daemon = True
+          self.thread.start()
+        self.cv.notify()
+      finally:
+        self.cv.release()
+    return entry
+
+  def Wait(self, entry):
+    if hasattr(os, 'waitid'):
+      WaitForExit(entry.process)
+      self.Finish(entry)
+      return Reap(entry)
+    if entry.deadline is None or utils.IsWindows():
+      # Nothing can kill an unwatched process, and on Windows the Popen
+      # handle keeps the pid from being reused until it is closed.
+      exit_code = Reap(entry)
+      self.Finish(entry)
+      return exit_code
+    return self.PollAndReap(entry)
+
+  def PollAndReap(self, entry):
+    """Without a way to wait for an exit without reaping, reap the child
+    with the supervisor lock held, so that a timeout can never kill its
+    pid after it has been reused."""
+    sleep_time = INITIAL_SLEEP_TIME
+    self.cv.acquire()
+    try:
+      while True:
+        exit_code = Reap(entry, block=False)
+        if exit_code is not None:
+          self.Finish(entry, polled=True)
+          return exit_code
+        self.cv.wait(sleep_time)
+        sleep_time = min(sleep_time * SLEEP_TIME_FACTOR, MAX_SLEEP_TIME)
+    finally:
+      self.cv.release()
+
+  def Finish(self, entry, polled=False):
+    self.cv.acquire()
+    try:
+      entry.finished = True
+      if not entry.timed_out and not polled:
+        self.estimated_latency_saved += PollingLatency(time.time() - entry.start)
+    finally:
+      self.cv.release()
+
+  def Supervise(self):
+    self.cv.acquire()
+    try:
+      while True:
+        while self.deadlines and self.deadlines[0][2].finished:
+          heapq.heappop(self.deadlines)
+        if not self.deadlines:
+          self.cv.wait()
+          continue
+        deadline, _, entry = self.deadlines[0]
+        now = time.time()
+        if now < deadline:
+          self.cv.wait(deadline - now)
+          continue
+        heapq.heappop(self.deadlines)
+        entry.timed_out = True
+        KillTimedOutProcess(entry.context, entry.process.pid)
+    finally:
+      self.cv.release()
+
+
+SUPERVISOR = ProcessSupervisor()
+
+
+def StartProcess(context, args, **rest):
   if context.verbose: print("#", " ".join(args))
   popen_args = args
   prev_error_mode = SEM_INVALID_VALUE
@@ -644,29 +984,21 @@ def RunProcess(context, timeout, args, **rest):
   )
   if utils.IsWindows() and context.suppress_dialogs and prev_error_mode != SEM_INVALID_VALUE:
     Win32SetErrorMode(prev_error_mode)
-  # Compute the end time - if the process crosses this limit we
-  # consider it timed out.
-  if timeout is None: end_time = None
-  else: end_time = time.time() + timeout
-  timed_out = False
-  # Repeatedly check the exit code from the process in a
-  # loop and keep track of whether or not it times out.
-  exit_code = None
-  sleep_time = INITIAL_SLEEP_TIME
+  return process
+
+
+def WaitForProcess(context, process, timeout):
+  # The supervisor kills the process if it crosses its deadline; either way
+  # we are woken up as soon as it exits.
+  entry = SUPERVISOR.Watch(context, process, timeout)
+  exit_code = SUPERVISOR.Wait(entry)
+  return (exit_code, entry.timed_out, entry.usage)
 
-  while exit_code is None:
-    if (not end_time is None) and (time.time() >= end_time):
-      # Kill the process and wait for it to exit.
-      KillTimedOutProcess(context, process.pid)
-      exit_code = process.wait()
-      timed_out = True
-    else:
-      exit_code = process.poll()
-      time.sleep(sleep_time)
-      sleep_time = sleep_time * SLEEP_TIME_FACTOR
-      if sleep_time > MAX_SLEEP_TIME:
-        sleep_time = MAX_SLEEP_TIME
-  return (process, exit_code, timed_out)
+
+def RunProcess(context, timeout, args, **rest):
+  process = StartProcess(context, args, **rest)
+  (exit_code, timed_out, usage) = WaitForProcess(context, process, timeout)
+  return (process, exit_code, timed_out, usage)
 
 
 def PrintError(str):
@@ -688,10 +1020,101 @@ def CheckedUnlink(name):
       PrintError("os.unlink() " + str(e))
     break
 
-def Execute(args, context, timeout=None, env=None, disable_core_files=False, stdin=None):
-  (fd_out, outname) = tempfile.mkstemp()
-  (fd_err, errname) = tempfile.mkstemp()
+# How long to keep draining a test's pipes after it has exited. Only matters
+# when a detached grandchild inherited them and keeps them open; draining
+# stops earlier once a pipe has been quiet for PIPE_QUIET_INTERVAL.
+PIPE_DRAIN_TIMEOUT = 1
+PIPE_QUIET_INTERVAL = 0.05
+# Appended to captured output when draining stopped before end of file, so
+# that output a grandchild writes later is not lost silently.
+PIPE_TRUNCATED_MARKER = '\n[output truncated]\n'
+
+
+def DecodeOutput(data):
+  """Turns captured bytes into what reading a text file would have given."""
+  if sys.version_info[0] < 3:
+    if utils.IsWindows():
+      return data.replace('\r\n', '\n')
+    return data
+  return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+class PipeCollector(object):
+  """Drains one of a child's pipes from a background thread. Output is kept
+  in memory up to |limit| bytes; anything beyond that spills to a temporary
+  file so a very chatty test cannot exhaust the runner's memory."""
+
+  def __init__(self, pipe, limit):
+    self.pipe = pipe
+    self.limit = limit
+    self.chunks = []
+    self.size = 0
+    self.spill = None
+    # Guards everything below, which Finish() may look at while the drain
+    # thread is still running.
+    self.lock = threading.Lock()
+    self.finished = False
+    self.drained = False
+    self.thread = threading.Thread(target=self.Drain)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Drain(self):
+    try:
+      while True:
+        chunk = os.read(self.pipe.fileno(), 65536)
+        with self.lock:
+          if not chunk:
+            self.drained = True
+            break
+          if self.finished:
+            # Finish() has already marked the output as truncated.
+            break
+          if self.spill is None and self.size + len(chunk) > self.limit:
+            self.spill = tempfile.TemporaryFile()
+            self.spill.write(b''.join(self.chunks))
+            self.chunks = []
+          if self.spill is None:
+            self.chunks.append(chunk)
+          else:
+            self.spill.write(chunk)
+          self.size += len(chunk)
+    finally:
+      self.pipe.close()
+      with self.lock:
+        self.drained = True
+        # Finish() leaves the spill file to us if we were still running.
+        if self.finished and self.spill is not None:
+          self.spill.close()
+
+  def Finish(self):
+    # Wait for EOF, but give up early once the pipe has gone quiet: the
+    # remaining writer is then a grandchild that outlives the test.
+    deadline = time.time() + PIPE_DRAIN_TIMEOUT
+    size = -1
+    while self.thread.is_alive() and time.time() < deadline:
+      with self.lock:
+        if self.size == size:
+          break
+        size = self.size
+      self.thread.join(PIPE_QUIET_INTERVAL)
+    with self.lock:
+      self.finished = True
+      truncated = not self.drained
+      if self.spill is None:
+        data = b''.join(self.chunks)
+      else:
+        self.spill.seek(0)
+        data = self.spill.read()
+        if self.drained:
+          self.spill.close()
+    output = DecodeOutput(data)
+    if truncated:
+      output += PIPE_TRUNCATED_MARKER
+    return output
+
 
+def Execute(args, context, timeout=None, env=None, disable_core_files=False, stdin=None):
   if env is None:
     env = {}
   env_copy = os.environ.copy()
@@ -712,14 +1135,43 @@ def Execute(args, context, timeout=None, env=None, disable_core_files=False, std
       resource.setrlimit(resource.RLIMIT_CORE, (0,0))
     preexec_fn = disableCoreFiles
 
-  (process, exit_code, timed_out) = RunProcess(
+  if context.output_capture == 'file':
+    return ExecuteWithFiles(context, timeout, args, stdin, env_copy,
+                            preexec_fn)
+
+  process = StartProcess(
+    context,
+    args = args,
+    stdin = stdin,
+    stdout = subprocess.PIPE,
+    stderr = subprocess.PIPE,
+    env = env_copy,
+    preexec_fn = preexec_fn,
+    # Keep concurrently started tests from inheriting each other's pipes,
+    # which would delay EOF until the unrelated child exits.
+    close_fds = not utils.IsWindows()
+  )
+  out = PipeCollector(process.stdout, context.output_buffer_size)
+  err = PipeCollector(process.stderr, context.output_buffer_size)
+  (exit_code, timed_out, usage) = WaitForProcess(context, process, timeout)
+  output = out.Finish()
+  errors = err.Finish()
+
+  return CommandOutput(exit_code, timed_out, output, errors, usage)
+
+
+def ExecuteWithFiles(context, timeout, args, stdin, env, preexec_fn):
+  (fd_out, outname) = tempfile.mkstemp()
+  (fd_err, errname) = tempfile.mkstemp()
+
+  (process, exit_code, timed_out, usage) = RunProcess(
     context,
     timeout,
     args = args,
     stdin = stdin,
     stdout = fd_out,
     stderr = fd_err,
-    env = env_copy,
+    env = env,
     preexec_fn = preexec_fn
   )
   os.close(fd_out)
@@ -729,7 +1181,112 @@ def Execute(args, context, timeout=None, env=None, disable_core_files=False, std
   CheckedUnlink(outname)
   CheckedUnlink(errname)
 
-  return CommandOutput(exit_code, timed_out, output, errors)
+  return CommandOutput(exit_code, timed_out, output, errors, usage)
+
+
+def FromJSONString(value):
+  if sys.version_info[0] < 3:
+    return value.encode('utf-8')
+  return value
+
+
+class WorkerServer(object):
+  """A long-lived node process running tools/run-worker-server.js."""
+
+  def __init__(self, context, vm, script, env):
+    self.process = StartProcess(
+      context,
+      args = [vm, script],
+      stdin = subprocess.PIPE,
+      stdout = subprocess.PIPE,
+      stderr = subprocess.STDOUT,
+      env = env,
+      close_fds = not utils.IsWindows()
+    )
+    self.responses = Queue()
+    self.log = []
+    self.thread = threading.Thread(target=self.ReadResponses)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def ReadResponses(self):
+    for line in iter(self.process.stdout.readline, b''):
+      try:
+        self.responses.put(json.loads(line.decode('utf-8')))
+      except ValueError:
+        # Anything the server itself prints ends up in the log.
+        self.log.append(line)
+    self.responses.put(None)
+
+  def Run(self, request, timeout):
+    self.process.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+    self.process.stdin.flush()
+    return self.responses.get(timeout=timeout)
+
+  def Close(self):
+    try:
+      self.process.stdin.close()
+    except IOError:
+      pass
+
+
+class WorkerPool(object):
+  """Runs tests in Workers of already bootstrapped node processes, one
+  process per test thread and executable. A server that crashes or times
+  out is discarded and replaced for the next test."""
+
+  def __init__(self, script):
+    self.script = script
+    self.servers = {}
+    self.lock = threading.Lock()
+
+  def __deepcopy__(self, memo):
+    # --repeat deep-copies test cases; they all share the same servers.
+    return self
+
+  def Execute(self, args, context, timeout, env, thread_id):
+    (vm, file) = args
+    env_copy = os.environ.copy()
+    if "NODE_PATH" in env_copy:
+      del env_copy["NODE_PATH"]
+    for key, value in env.items():
+      env_copy[key] = value
+
+    key = (thread_id, vm)
+    self.lock.acquire()
+    server = self.servers.pop(key, None)
+    self.lock.release()
+    if server is None or server.process.poll() is not None:
+      server = WorkerServer(context, vm, self.script, env_copy)
+    if context.verbose: print("# [worker]", " ".join(args))
+    del server.log[:]
+    try:
+      response = server.Run({ 'file': file, 'env': env_copy }, timeout)
+    except Empty:
+      KillTimedOutProcess(context, server.process.pid)
+      return CommandOutput(server.process.wait(), True, '', '')
+    except IOError:
+      response = None
+    if response is None:
+      # The whole server went down, e.g. because the test crashed it.
+      log = DecodeOutput(b''.join(server.log))
+      return CommandOutput(server.process.wait(), False, '', log)
+    self.lock.acquire()
+    self.servers[key] = server
+    self.lock.release()
+    return CommandOutput(response['exitCode'], False,
+                         FromJSONString(response['stdout']),
+                         FromJSONString(response['stderr']))
+
+  def Shutdown(self):
+    self.lock.acquire()
+    servers = list(self.servers.values())
+    self.servers.clear()
+    self.lock.release()
+    for server in servers:
+      server.Close()
+    for server in servers:
+      server.process.wait()
 
 
 def CarCdr(path):
@@ -756,7 +1313,10 @@ class TestConfiguration(object):
   def GetTestStatus(self, sections, defs):
     status_file = join(self.root, '%s.status' % self.section)
     if exists(status_file):
-      ReadConfigurationInto(status_file, sections, defs)
+      if self.context.status_cache is not None:
+        self.context.status_cache.ReadInto(status_file, sections, defs)
+      else:
+        ReadConfigurationInto(status_file, sections, defs)
 
 
 class TestSuite(object):
@@ -842,6 +1402,10 @@ class LiteralTestSuite(TestSuite):
       tests_repos.GetTestStatus(context, sections, defs)
 
 
+# Per-stream amount of test output kept in memory before spilling to disk.
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024
+
+
 TIMEOUT_SCALEFACTOR = {
     'armv6' : { 'debug' : 12, 'release' : 3 },  # The ARM buildbots are slow.
     'arm'   : { 'debug' :  8, 'release' : 2 },
@@ -868,6 +1432,11 @@ class Context(object):
     self.abort_on_timeout = abort_on_timeout
     self.v8_enable_inspector = True
     self.node_has_crypto = True
+    self.output_capture = 'pipe'
+    self.output_buffer_size = OUTPUT_BUFFER_SIZE
+    self.status_cache = None
+    self.worker_pool = None
+    self.deps_recorder = None
 
   def GetVm(self, arch, mode):
     if self.vm is not None:
@@ -893,9 +1462,208 @@ class Context(object):
   def GetTimeout(self, mode):
     return self.timeout * TIMEOUT_SCALEFACTOR[ARCH_GUESS or 'ia32'][mode]
 
-def RunTestCases(cases_to_run, progress, tasks, flaky_tests_mode):
+def SaveJSON(path, data):
+  """Replaces |path| with |data| as JSON, creating its directory if needed."""
+  directory = dirname(path)
+  if directory and not isdir(directory):
+    os.makedirs(directory)
+  temp = path + '.tmp'
+  with open(temp, 'w') as f:
+    json.dump(data, f, indent=0, sort_keys=True, separators=(',', ': '))
+  if utils.IsWindows() and exists(path):
+    os.unlink(path)
+  os.rename(temp, path)
+
+
+class DurationHistory(object):
+  """Wall-clock durations of tests from previous runs, persisted as JSON and
+  used to schedule the longest tests first."""
+
+  # Weight of the latest run in the recorded moving average.
+  WEIGHT = 0.5
+
+  def __init__(self, path):
+    self.path = path
+    self.durations = {}
+    try:
+      with open(path) as f:
+        self.durations = json.load(f)
+    except (IOError, OSError, ValueError):
+      pass
+    known = sorted(self.durations.values())
+    # Tests without history are assumed to be typical ones.
+    self.default = known[len(known) // 2] if known else 1.0
+
+  @staticmethod
+  def Key(case):
+    return '%s %s' % (case.mode, '/'.join(case.path))
+
+  def Get(self, case):
+    return self.durations.get(self.Key(case))
+
+  def Predict(self, case):
+    duration = self.Get(case)
+    if duration is None:
+      return self.default
+    return duration
+
+  def Record(self, case):
+    if case.duration is None:
+      return
+    key = self.Key(case)
+    duration = TotalSeconds(case.duration)
+    if key in self.durations:
+      duration = (self.WEIGHT * duration +
+                  (1 - self.WEIGHT) * self.durations[key])
+    self.durations[key] = duration
+
+  def Save(self):
+    SaveJSON(self.path, self.durations)
+
+
+class DependencyMap(object):
+  """The files each test loaded, as recorded by a run with --record-deps,
+  persisted as JSON and used to select the tests a change can affect."""
+
+  def __init__(self, path, workspace):
+    self.path = path
+    self.workspace = workspace
+    self.recorder = join(workspace, 'tools', 'record-deps.js')
+    self.deps = {}
+    self.lock = threading.Lock()
+    try:
+      with open(path) as f:
+        self.deps = json.load(f)
+    except (IOError, OSError, ValueError):
+      pass
+
+  def __deepcopy__(self, memo):
+    return self
+
+  @staticmethod
+  def Key(case):
+    return '/'.join(case.path)
+
+  def Relative(self, path):
+    path = os.path.relpath(abspath(join(self.workspace, path)), self.workspace)
+    return path.replace(os.sep, '/')
+
+  def Prepare(self, env):
+    (fd, deps_file) = tempfile.mkstemp()
+    os.close(fd)
+    require = '--require "%s"' % self.recorder.replace('\\', '\\\\')
+    # Keep whatever NODE_OPTIONS the test would otherwise have run with.
+    options = env.get('NODE_OPTIONS', os.environ.get('NODE_OPTIONS', ''))
+    env['NODE_OPTIONS'] = ' '.join(
+        option for option in [options, require] if option)
+    env['NODE_TEST_DEPS_FILE'] = deps_file
+    return deps_file
+
+  def Collect(self, case, deps_file):
+    files = set()
+    with open(deps_file) as f:
+      for line in f:
+        try:
+          files.update(json.loads(line))
+        except ValueError:
+          pass
+    CheckedUnlink(deps_file)
+    files = set(self.Relative(f) for f in files)
+    files = sorted(f for f in files if not f.startswith('..'))
+    self.lock.acquire()
+    # A process that crashed or was killed recorded nothing; leave the test
+    # unknown rather than pretend it has no dependencies.
+    if files:
+      self.deps[self.Key(case)] = files
+    else:
+      self.deps.pop(self.Key(case), None)
+    self.lock.release()
+
+  def IsAffected(self, case, changed):
+    """Whether |case| may be affected by the workspace-relative paths in
+    |changed|. Tests without a record, ES module tests (whose imports are
+    not recorded) and changes to anything but JavaScript under lib/ and
+    test/ select every test. So does any change under test/fixtures/:
+    tests also read fixtures with fs or run them in child processes whose
+    environment drops the recorder, and neither shows up in the record.
+
+    Only modules loaded through require() by the test or by children that
+    keep NODE_OPTIONS are recorded. A test that reads any other JavaScript
+    file outside test/fixtures/ is not selected when that file changes."""
+    deps = self.deps.get(self.Key(case))
+    if deps is None or case.file.endswith('.mjs'):
+      return True
+    if self.Relative(case.file) in changed:
+      return True
+    for path in changed:
+      if not (path.startswith('lib/') or path.startswith('test/')):
+        return True
+      if path.startswith('test/fixtures/'):
+        return True
+      if not (path.endswith('.js') or path.endswith('.mjs')):
+        return True
+    return bool(changed.intersection(deps))
+
+  def Save(self):
+    SaveJSON(self.path, self.deps)
+
+
+def GetChangedFiles(workspace, paths, since):
+  changed = [p for p in paths.split(',') if p]
+  if since:
+    diff = subprocess.Popen(['git', 'diff', '--name-only', since],
+                            cwd=workspace, stdout=subprocess.PIPE)
+    changed += [l for l in diff.communicate()[0].decode('utf-8').splitlines()
+                if l]
+  return changed
+
+
+class FlakinessDatabase(object):
+  """How often each test passed only after being retried, persisted as JSON.
+  Tests that do so repeatedly are run in isolation from the start."""
+
+  # A test is isolated once it has passed on retry at least MIN_FLAKES times
+  # and in at least FLAKE_RATE of its recorded runs.
+  MIN_FLAKES = 2
+  FLAKE_RATE = 0.05
+
+  def __init__(self, path):
+    self.path = path
+    self.tests = {}
+    try:
+      with open(path) as f:
+        self.tests = json.load(f)
+    except (IOError, OSError, ValueError):
+      pass
+
+  @staticmethod
+  def Key(case):
+    return '/'.join(case.path)
+
+  def ShouldIsolate(self, case):
+    entry = self.tests.get(self.Key(case))
+    if entry is None:
+      return False
+    return (entry['flaky'] >= self.MIN_FLAKES and
+            entry['flaky'] >= self.FLAKE_RATE * entry['runs'])
+
+  def Record(self, case, passed):
+    entry = self.tests.setdefault(self.Key(case),
+                                  {'runs': 0, 'flaky': 0, 'failed': 0})
+    entry['runs'] += 1
+    if not passed:
+      entry['failed'] += 1
+    elif case.failures:
+      entry['flaky'] += 1
+
+  def Save(self):
+    SaveJSON(self.path, self.tests)
+
+
+def RunTestCases(cases_to_run, progress, tasks, flaky_tests_mode,
+                 history=None, retries=0, flakiness=None, overlap=False):
   progress = PROGRESS_INDICATORS[progress](cases_to_run, flaky_tests_mode)
-  return progress.Run(tasks)
+  return progress.Run(tasks, history, retries, flakiness, overlap)
 
 # -------------------------------------------
 # --- T e s t   C o n f i g u r a t i o n ---
@@ -1166,14 +1934,19 @@ class Configuration(object):
   def ClassifyTests(self, cases, env):
     sections = [ s for s in self.sections if s.condition.Evaluate(env, self.defs) ]
     all_rules = reduce(list.__add__, [s.rules for s in sections], [])
+    index = RuleIndex(all_rules)
     unused_rules = set(all_rules)
+    rule_outcomes = {}
     result = []
     for case in cases:
-      matches = [ r for r in all_rules if r.Contains(case.path) ]
-      outcomes_list = [ r.GetOutcomes(env, self.defs) for r in matches ]
-      outcomes = reduce(set.union, outcomes_list, set())
+      matches = index.Match(case.path)
+      outcomes = set()
+      for rule in matches:
+        if rule not in rule_outcomes:
+          rule_outcomes[rule] = rule.GetOutcomes(env, self.defs)
+        outcomes |= rule_outcomes[rule]
       unused_rules.difference_update(matches)
-      case.outcomes = set(outcomes) or set([PASS])
+      case.outcomes = outcomes or set([PASS])
       # slow tests may also just pass.
       if SLOW in case.outcomes:
         case.outcomes.add(PASS)
@@ -1181,6 +1954,29 @@ class Configuration(object):
     return result, unused_rules
 
 
+class RuleIndex(object):
+  """The active rules of a configuration, indexed by their path. Rules whose
+  path consists of literal names are looked up by the prefixes of a test's
+  path; only rules containing wildcards are matched one by one."""
+
+  def __init__(self, rules):
+    self.literal = {}
+    self.wildcard = []
+    for rule in rules:
+      key = rule.LiteralPath()
+      if key is None:
+        self.wildcard.append(rule)
+      else:
+        self.literal.setdefault(key, []).append(rule)
+
+  def Match(self, path):
+    result = []
+    for i in range(len(path) + 1):
+      result += self.literal.get(tuple(path[:i]), [])
+    result += [r for r in self.wildcard if r.Contains(path)]
+    return result
+
+
 class Section(object):
   """A section of the configuration file.  Sections are enabled or
   disabled prior to running the tests, based on their conditions"""
@@ -1213,7 +2009,15 @@ class Rule(object):
         return False
     return True
 
+  def LiteralPath(self):
+    """Returns the path as a tuple of names if it only matches itself."""
+    names = tuple(str(p) for p in self.path)
+    if all(LITERAL_PATTERN.match(n) for n in names):
+      return names
+    return None
+
 
+LITERAL_PATTERN = re.compile(r'^[\w\-]+$')
 HEADER_PATTERN = re.compile(r'\[([^]]+)\]')
 RULE_PATTERN = re.compile(r'\s*([^: ]*)\s*:(.*)')
 DEF_PATTERN = re.compile(r'^def\s*(\w+)\s*=(.*)$')
@@ -1257,6 +2061,53 @@ def ReadConfigurationInto(path, sections, defs):
     raise Exception("Malformed line: '%s'." % line)
 
 
+class StatusFileCache(object):
+  """Parsed .status files from previous runs, pickled to disk and reused for
+  as long as the file's mtime and size are unchanged."""
+
+  def __init__(self, path):
+    self.path = path
+    self.entries = {}
+    self.dirty = False
+    try:
+      with open(path, 'rb') as f:
+        self.entries = pickle.load(f)
+    except Exception:
+      # A missing, truncated or incompatible cache is simply rebuilt.
+      pass
+
+  def ReadInto(self, status_file, sections, defs):
+    stat = os.stat(status_file)
+    key = (stat.st_mtime, stat.st_size)
+    entry = self.entries.get(status_file)
+    if entry is None or entry[0] != key:
+      file_sections = []
+      file_defs = {}
+      if ReadConfigurationInto(status_file, file_sections, file_defs) is False:
+        sections += file_sections
+        defs.update(file_defs)
+        return
+      entry = (key, file_sections, file_defs)
+      self.entries[status_file] = entry
+      self.dirty = True
+    sections += entry[1]
+    defs.update(entry[2])
+
+  def Save(self):
+    if not self.dirty:
+      return
+    directory = dirname(self.path)
+    if directory and not isdir(directory):
+      os.makedirs(directory)
+    temp = self.path + '.tmp'
+    with open(temp, 'wb') as f:
+      pickle.dump(self.entries, f, 2)
+    if utils.IsWindows() and exists(self.path):
+      os.unlink(self.path)
+    os.rename(temp, self.path)
+    self.dirty = False
+
+
 # ---------------
 # --- M a i n ---
 # ---------------
@@ -1295,6 +2146,9 @@ def BuildOptions():
       default=False, action="store_true")
   result.add_option("--worker", help="Run parallel tests inside a worker context",
       default=False, action="store_true")
+  result.add_option("--worker-pool",
+      help="Run parallel tests without flags in Workers of long-lived node processes",
+      default=False, action="store_true", dest="worker_pool")
   result.add_option("--check-deopts", help="Check tests for permanent deoptimizations",
       default=False, action="store_true")
   result.add_option("--cat", help="Print the source of the tests",
@@ -1302,6 +2156,13 @@ def BuildOptions():
   result.add_option("--flaky-tests",
       help="Regard tests marked as flaky (run|skip|dontcare)",
       default="run")
+  result.add_option("--retries",
+      help="Run failing tests again, one at a time, up to this many times",
+      default=0, type="int")
+  result.add_option("--flakiness-file",
+      help="Where to keep retry statistics used to isolate flaky tests "
+           "(default: out/test-flakiness.json)",
+      default=None, dest="flakiness_file")
   result.add_option("--skip-tests",
       help="Tests that should not be executed (comma-separated)",
       default="")
@@ -1313,6 +2174,10 @@ def BuildOptions():
       default=False, action="store_true")
   result.add_option("--time", help="Print timing information after running",
       default=False, action="store_true")
+  result.add_option("--resource-report",
+      help="Write each test's peak RSS, CPU time and page faults to this "
+           "file as JSON lines, and summarize the heaviest tests",
+      default=None, dest="resource_report")
   result.add_option("--suppress-dialogs", help="Suppress Windows dialogs for crashing tests",
         dest="suppress_dialogs", default=True, action="store_true")
   result.add_option("--no-suppress-dialogs", help="Display Windows dialogs for crashing tests",
@@ -1327,6 +2192,11 @@ def BuildOptions():
   result.add_option("-r", "--run",
       help="Divide the tests in m groups (interleaved) and run tests from group n (--run=n,m with n < m)",
       default="")
+  result.add_option("--shard-by",
+      help="How --run divides the tests: equal test counts, or equal "
+           "predicted time from the --durations-file given, which a "
+           "sharded run does not update (count|duration)",
+      choices=['count', 'duration'], default='count', dest="shard_by")
   result.add_option('--temp-dir',
       help='Optional path to change directory used for tests', default=False)
   result.add_option('--test-root',
@@ -1337,6 +2207,35 @@ def BuildOptions():
   result.add_option('--abort-on-timeout',
       help='Send SIGABRT instead of SIGTERM to kill processes that time out',
       default=False, action="store_true", dest="abort_on_timeout")
+  result.add_option("--output-capture",
+      help="How to collect test output: in memory through pipes, or through temporary files (pipe|file)",
+      choices=['pipe', 'file'], default='pipe', dest="output_capture")
+  result.add_option("--output-buffer-size",
+      help="Bytes of output per stream kept in memory before spilling to disk",
+      default=OUTPUT_BUFFER_SIZE, type="int", dest="output_buffer_size")
+  result.add_option("--durations-file",
+      help="Keep test durations in this file and run the longest tests "
+           "first (by default tests run in discovery order)",
+      default=None, dest="durations_file")
+  result.add_option("--overlap-sequential",
+      help="Let sequential tests not marked flaky start before the parallel "
+           "tests have finished (needs --durations-file)",
+      default=False, action="store_true", dest="overlap_sequential")
+  result.add_option("--record-deps",
+      help="Record which files every test loads, for --affected-by",
+      default=False, action="store_true", dest="record_deps")
+  result.add_option("--deps-file",
+      help="Where to keep recorded test dependencies "
+           "(default: out/test-deps.json)",
+      default=None, dest="deps_file")
+  result.add_option("--affected-by",
+      help="Only run tests that may be affected by these changed files "
+           "(comma-separated)",
+      default="", dest="affected_by")
+  result.add_option("--affected-since",
+      help="Only run tests that may be affected by changes since this git "
+           "revision",
+      default=None, dest="affected_since")
   result.add_option("--type",
       help="Type of build (simple, fips, coverage)",
       default=None)
@@ -1368,6 +2267,10 @@ def ProcessOptions(options):
     if options.run[0] >= options.run[1]:
       print("The test group to run (n) must be smaller than number of groups (m).")
       return False
+  if options.shard_by == 'duration' and options.durations_file is None:
+    # A local history differs between machines, and so would the shards.
+    print("--shard-by=duration needs the same --durations-file on every shard.")
+    return False
   if options.J:
     # inherit JOBS from environment if provided. some virtualised systems
     # tends to exaggerate the number of available cpus/cores.
@@ -1420,6 +2323,84 @@ def NormalizePath(path, prefix='test/'):
     path = path[:-4]
   return path
 
+class Shard(object):
+
+  def __init__(self):
+    self.cases = []
+    self.predicted = 0
+
+
+def BalanceShards(cases, count, history):
+  """Splits |cases| into |count| shards of roughly equal predicted run time.
+  Tests with recorded durations are placed longest first onto the shard that
+  is least loaded so far; tests without history are spread by a hash of
+  their name. Every machine computes the same partition as long as all
+  shards read the same durations file, which is why sharded runs never
+  update it."""
+  shards = [Shard() for i in range(count)]
+  timed = []
+  for case in cases:
+    duration = history.Get(case) if history is not None else None
+    if duration is None:
+      key = DurationHistory.Key(case).encode('utf-8')
+      shard = shards[(zlib.crc32(key) & 0xffffffff) % count]
+      shard.cases.append(case)
+      shard.predicted += history.default if history is not None else 0
+    else:
+      timed.append((duration, case))
+  timed.sort(key=lambda t: (-t[0], DurationHistory.Key(t[1])))
+  for duration, case in timed:
+    shard = min(shards, key=lambda s: s.predicted)
+    shard.cases.append(case)
+    shard.predicted += duration
+  for shard in shards:
+    shard.cases.sort(key=lambda c: (c.arch, c.mode, c.file))
+  return shards
+
+
+def PrintShards(shards, selected):
+  for i, shard in enumerate(shards):
+    sys.stderr.write("%s shard %d/%d: %4d tests, predicted %s\n" % (
+        '*' if i == selected else ' ', i, len(shards), len(shard.cases),
+        FormatTime(shard.predicted)))
+
+
+def WriteResourceReport(path, cases):
+  """Writes one JSON record per test run with its resource usage."""
+  with open(path, 'w') as f:
+    for case in cases:
+      if case.duration is None:
+        continue
+      record = {
+        'test': '/'.join(case.path),
+        'mode': case.mode,
+        'arch': case.arch,
+        'duration': TotalSeconds(case.duration)
+      }
+      if case.usage is not None:
+        record.update(case.usage.ToDict())
+      f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def PrintResourceSummary(cases, jobs, count=10):
+  measured = [c for c in cases if c.usage is not None]
+  if not measured:
+    return
+  sys.stderr.write("--- Peak RSS ---\n")
+  measured.sort(key=lambda c: c.usage.max_rss, reverse=True)
+  for i, case in enumerate(measured[:count], start=1):
+    sys.stderr.write("%4i (%7.1f MiB) %s\n" % (
+        i, case.usage.max_rss / 1024.0, case.GetLabel()))
+  worst = sum(c.usage.max_rss for c in measured[:jobs]) / 1024.0
+  sys.stderr.write("--- %d largest tests together: %.1f MiB ---\n" % (
+      min(jobs, len(measured)), worst))
+  sys.stderr.write("--- CPU time (user + system) ---\n")
+  measured.sort(key=lambda c: c.usage.CpuTime(), reverse=True)
+  for i, case in enumerate(measured[:count], start=1):
+    sys.stderr.write("%4i (%s) %s\n" % (
+        i, FormatTime(case.usage.CpuTime()), case.GetLabel()))
+
+
 def GetSpecialCommandProcessor(value):
   if (not value) or (value.find('@') == -1):
     def ExpandCommand(args):
@@ -1444,12 +2425,15 @@ def FormatTime(d):
   return time.strftime("%M:%S.", time.gmtime(d)) + ("%03i" % millis)
 
 
-def FormatTimedelta(td):
+def TotalSeconds(td):
   if hasattr(td, 'total_seconds'):
-    d = td.total_seconds()
+    return td.total_seconds()
   else: # python2.6 compat
-    d =  td.seconds + (td.microseconds / 10.0**6)
-  return FormatTime(d)
+    return td.seconds + (td.microseconds / 10.0**6)
+
+
+def FormatTimedelta(td):
+  return FormatTime(TotalSeconds(td))
 
 
 def PrintCrashed(code):
@@ -1554,12 +2538,27 @@ def Main():
                     options.store_unexpected_output,
                     options.repeat,
                     options.abort_on_timeout)
+  context.output_capture = options.output_capture
+  deps_file = (options.deps_file or
+               join(workspace, 'out', 'test-deps.json'))
+  if options.record_deps:
+    context.deps_recorder = DependencyMap(deps_file, workspace)
+  if options.worker_pool and not options.worker:
+    context.worker_pool = WorkerPool(
+        join(workspace, "tools", "run-worker-server.js"))
+  context.output_buffer_size = options.output_buffer_size
 
   # Get status for tests
+  context.status_cache = StatusFileCache(
+      join(workspace, 'out', 'test-status.py%d.cache' % sys.version_info[0]))
   sections = [ ]
   defs = { }
   root.GetTestStatus(context, sections, defs)
   config = Configuration(sections, defs)
+  try:
+    context.status_cache.Save()
+  except (IOError, OSError) as e:
+    print("Could not save the status file cache: %s" % e)
 
   # List the tests
   all_cases = [ ]
@@ -1648,6 +2647,15 @@ def Main():
     test_case for test_case in all_cases if should_keep(test_case)
   ]
 
+  if options.affected_by or options.affected_since:
+    changed = GetChangedFiles(workspace, options.affected_by,
+                              options.affected_since)
+    deps = DependencyMap(deps_file, workspace)
+    changed = set(deps.Relative(p) for p in changed)
+    cases_to_run = [c for c in cases_to_run if deps.IsAffected(c, changed)]
+    print("%d tests may be affected by %d changed files" %
+          (len(cases_to_run), len(changed)))
+
   if options.report:
     print(REPORT_TEMPLATE % {
       'total': len(all_cases),
@@ -1657,22 +2665,39 @@ def Main():
       'fail': len([t for t in cases_to_run if t.outcomes == set([FAIL])])
     })
 
+  history = None
+  if options.durations_file:
+    history = DurationHistory(options.durations_file)
+
   if options.run is not None:
     # Must ensure the list of tests is sorted before selecting, to avoid
     # silent errors if this file is changed to list the tests in a way that
     # can be different in different machines
     cases_to_run.sort(key=lambda c: (c.arch, c.mode, c.file))
-    cases_to_run = [ cases_to_run[i] for i
-                     in range(options.run[0],
-                               len(cases_to_run),
-                               options.run[1]) ]
+    if options.shard_by == 'duration':
+      shards = BalanceShards(cases_to_run, options.run[1], history)
+      PrintShards(shards, options.run[0])
+      cases_to_run = shards[options.run[0]].cases
+    else:
+      cases_to_run = [ cases_to_run[i] for i
+                       in range(options.run[0],
+                                 len(cases_to_run),
+                                 options.run[1]) ]
+
+  flakiness = None
+  if options.retries > 0:
+    flakiness = FlakinessDatabase(options.flakiness_file or
+                                  join(workspace, 'out', 'test-flakiness.json'))
+
   if len(cases_to_run) == 0:
     print("No tests to run.")
     return 1
   else:
     try:
       start = time.time()
-      if RunTestCases(cases_to_run, options.progress, options.j, options.flaky_tests):
+      if RunTestCases(cases_to_run, options.progress, options.j,
+                      options.flaky_tests, history, options.retries,
+                      flakiness, options.overlap_sequential):
         result = 0
       else:
         result = 1
@@ -1681,6 +2706,33 @@ def Main():
       print("Interrupted")
       return 1
 
+  if context.worker_pool is not None:
+    context.worker_pool.Shutdown()
+
+  if context.deps_recorder is not None:
+    try:
+      context.deps_recorder.Save()
+    except (IOError, OSError) as e:
+      print("Could not save test dependencies: %s" % e)
+
+  if options.resource_report:
+    WriteResourceReport(options.resource_report, cases_to_run)
+    PrintResourceSummary(cases_to_run, options.j)
+
+  # Each shard only sees part of the tests, so a sharded run leaves the
+  # durations the partition was computed from alone.
+  if history is not None and options.run is None:
+    try:
+      history.Save()
+    except (IOError, OSError) as e:
+      print("Could not save test durations: %s" % e)
+
+  if flakiness is not None:
+    try:
+      flakiness.Save()
+    except (IOError, OSError) as e:
+      print("Could not save flakiness statistics: %s" % e)
+
   if options.time:
     # Write the times to stderr to make it easy to separate from the
     # test output.
@@ -1691,6 +2743,14 @@ def Main():
     for i, entry in enumerate(timed_tests[:20], start=1):
       t = FormatTimedelta(entry.duration)
       sys.stderr.write("%4i (%s) %s\n" % (i, t, entry.GetLabel()))
+    # This is not measured: it models what the old poll()/sleep() loop would
+    # have cost on top, from each test's runtime and the old backoff.
+    saved = SUPERVISOR.estimated_latency_saved
+    sys.stderr.write("--- Exit polling avoided (estimated from the old "
+                     "backoff, not measured): %s thread time, "
+                     "~%s wall-clock at -j%d ---\n" %
+                     (FormatTime(saved), FormatTime(saved / max(options.j, 1)),
+                      options.j))
 
   return result
 